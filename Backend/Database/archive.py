@@ -0,0 +1,383 @@
+"""Cold storage for old chat messages.
+
+The archiver moves messages older than ARCHIVE_AFTER_DAYS out of the
+message table into gzip compressed JSON lines, one file per room and month:
+
+    ARCHIVE_DIR/<room_id>/2025-01.jsonl.gz
+    ARCHIVE_DIR/<room_id>/index.json    rows, seq range and time range per month
+
+Rows are archived in seq order and a month never receives rows older in
+seq than the months before it, so every month covers its own seq range.
+Batches are appended to a month as extra gzip members. Once a month is
+entirely past the cutoff nothing is appended to it any more, and it is
+compacted into one sorted member. A batch is written to its file before its
+rows are deleted from the table. After a crash a row can be in both places
+but never in neither, and readers drop the duplicate.
+
+Archived messages are read only. The FTS delete trigger takes them out of
+search along with their row, and they can no longer be deleted one by one.
+Every worker serving history has to see the same ARCHIVE_DIR.
+
+The same periodic run prunes message tombstones past
+TOMBSTONE_RETENTION_DAYS; /sync resets clients whose cursor is older.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows, run a single worker there
+    fcntl = None
+
+from Database.db import engine
+from models.message import Message
+from models.room import Room
+from models.tombstone import MessageTombstone
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+# messages older than this many days are archived, 0 turns the archiver off
+# (already archived history stays readable)
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+# deletions /sync can still report, a client offline for longer reloads its rooms
+TOMBSTONE_RETENTION_DAYS = float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+ARCHIVE_INTERVAL_SECONDS = 3600
+# rows read, written and deleted per transaction
+ARCHIVE_BATCH_ROWS = 5000
+# decoded month files and indexes kept in memory while clients page back
+ARCHIVE_CACHE_ENTRIES = 64
+ARCHIVE_CACHE_SECONDS = 600
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+
+SAFE_NAME = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def month_of(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m")
+
+
+def month_end(month: str) -> datetime:
+    year, number = map(int, month.split("-"))
+    return datetime(year + number // 12, number % 12 + 1, 1)
+
+
+def seq_of(row: dict) -> int:
+    return row["seq"]
+
+
+def read_partition(path: str) -> list:
+    """Every row of a month file, deduplicated and in seq order"""
+    rows = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+            rows[row["id"]] = row
+    return sorted(rows.values(), key=seq_of)
+
+
+def partition_info(rows: list, compacted: bool) -> dict:
+    """Index entry for the rows of a month, in seq order"""
+    return {
+        "rows": len(rows),
+        "first_seq": rows[0]["seq"],
+        "last_seq": rows[-1]["seq"],
+        "first": min(row["timestamp"] for row in rows).isoformat(),
+        "last": max(row["timestamp"] for row in rows).isoformat(),
+        "compacted": compacted,
+    }
+
+
+def read_index(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_durably(path: str, data: bytes, mode: str = "wb"):
+    with open(path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _encode(rows: list) -> bytes:
+    lines = "".join(json.dumps({**row, "timestamp": row["timestamp"].isoformat()}, separators=(",", ":")) + "\n"
+                    for row in rows)
+    return gzip.compress(lines.encode("utf-8"), compresslevel=6)
+
+
+class MessageArchive:
+    """Moves old messages into per room, per month archive files and reads them back for history"""
+
+    def __init__(self, engine, root: str = ARCHIVE_DIR, max_age_days: float = ARCHIVE_AFTER_DAYS,
+                 interval: float = ARCHIVE_INTERVAL_SECONDS, batch_rows: int = ARCHIVE_BATCH_ROWS):
+        self.engine = engine
+        self.root = root
+        self.max_age_days = max_age_days
+        self.interval = interval
+        self.batch_rows = batch_rows
+        # keyed by (path, mtime, size) so a file rewritten by any worker is never served stale
+        self.cache = TTLCache(ARCHIVE_CACHE_ENTRIES, ARCHIVE_CACHE_SECONDS)
+        self.task = None
+        self.wakeup = None
+        self.closing = False
+        self.runs = 0
+        self.failures = 0
+        self.rows_archived = 0
+        self.partitions_compacted = 0
+        self.tombstones_pruned = 0
+        self.last_run_seconds = 0.0
+
+    def room_dir(self, room_id: str) -> str:
+        name = room_id if SAFE_NAME.fullmatch(room_id) else hashlib.sha256(room_id.encode()).hexdigest()
+        return os.path.join(self.root, name)
+
+    def partition_path(self, room_id: str, month: str) -> str:
+        return os.path.join(self.room_dir(room_id), f"{month}.jsonl.gz")
+
+    def _cached(self, path: str, load):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        value = self.cache.get(key)
+        if value is None:
+            value = load(path)
+            self.cache.set(key, value)
+        return value
+
+    # ------------------------
+    # reading
+    # ------------------------
+    def history(self, room_id: str, before: int | None = None, after: int | None = None,
+                limit: int = 50) -> list:
+        """Archived messages of a room below seq `before` newest first, or above seq `after` oldest first.
+
+        Without either the newest archived messages are returned.
+        """
+        index = self._cached(os.path.join(self.room_dir(room_id), INDEX_FILE), read_index)
+        if not index:
+            return []
+        partitions = index["partitions"]
+        page = []
+        for month in sorted(partitions, reverse=after is None):
+            if len(page) >= limit:
+                break
+            info = partitions[month]
+            if before is not None and info["first_seq"] >= before:
+                continue
+            if after is not None and info["last_seq"] <= after:
+                continue
+            rows = self._cached(self.partition_path(room_id, month), read_partition) or []
+            if after is None:
+                end = len(rows) if before is None else bisect_left(rows, before, key=seq_of)
+                selected = rows[max(0, end - (limit - len(page))):end][::-1]
+            else:
+                start = bisect_right(rows, after, key=seq_of)
+                selected = rows[start:start + limit - len(page)]
+            # copies, the cached rows are shared between requests
+            page += [dict(row) for row in selected]
+        return page
+
+    def drop(self, room_id: str):
+        """Forget a deleted room's archive"""
+        shutil.rmtree(self.room_dir(room_id), ignore_errors=True)
+
+    # ------------------------
+    # archiving
+    # ------------------------
+    @contextmanager
+    def _exclusive(self):
+        """Only one worker archives at a time, the others skip the run"""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, LOCK_FILE), "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            yield True
+
+    def prune_tombstones(self, now: datetime | None = None) -> int:
+        """Delete tombstones past the retention, returns how many"""
+        horizon = (now or datetime.utcnow()) - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+        with self.engine.begin() as conn:
+            pruned = conn.execute(delete(MessageTombstone).where(MessageTombstone.deleted_at < horizon)).rowcount
+        self.tombstones_pruned += pruned
+        return pruned
+
+    def maintain(self) -> int:
+        """One periodic run: archive (when enabled) and prune tombstones, returns the rows archived"""
+        moved = self.archive_once() if self.max_age_days > 0 else 0
+        self.prune_tombstones()
+        return moved
+
+    def archive_once(self, now: datetime | None = None) -> int:
+        """Move every message older than the cutoff into the archive, returns the number of rows moved"""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.max_age_days)
+        with self.engine.connect() as conn:
+            room_ids = conn.execute(select(Room.id)).scalars().all()
+            # one index probe per room for its oldest message, most rooms have nothing to archive
+            due = []
+            for room_id in room_ids:
+                oldest = conn.execute(select(Message.timestamp).where(Message.room_id == room_id).
+                                      order_by(Message.seq).limit(1)).scalar()
+                if oldest is not None and oldest < cutoff:
+                    due.append(room_id)
+        if not due:
+            return 0
+        moved = 0
+        with self._exclusive() as acquired:
+            if not acquired:
+                return 0
+            for room_id in due:
+                if self.closing:
+                    break
+                moved += self._archive_room(room_id, cutoff)
+        return moved
+
+    def _archive_room(self, room_id: str, cutoff: datetime) -> int:
+        os.makedirs(self.room_dir(room_id), exist_ok=True)
+        columns = [Message.id, Message.room_id, Message.sender, Message.content, Message.timestamp, Message.seq]
+        index_path = os.path.join(self.room_dir(room_id), INDEX_FILE)
+        months = read_index(index_path)["partitions"] if os.path.exists(index_path) else {}
+        floor = max(months, default="")
+        moved = 0
+        touched = set()
+        while not self.closing:
+            # the archived rows are deleted as we go, so the lowest seqs left are always the next batch.
+            # The batch is cut at the first row inside the cutoff, which stops at the room's seq index
+            # instead of scanning every newer row for a timestamp match.
+            with self.engine.connect() as conn:
+                fetched = conn.execute(select(*columns).where(Message.room_id == room_id).
+                                       order_by(Message.seq).limit(self.batch_rows)).mappings().all()
+            rows = []
+            for row in fetched:
+                if row["timestamp"] >= cutoff:
+                    break
+                rows.append(dict(row))
+            if not rows:
+                break
+            by_month = {}
+            for row in rows:
+                # a row sent with a skewed clock stays with its seq neighbours
+                floor = max(floor, month_of(row["timestamp"]))
+                by_month.setdefault(floor, []).append(row)
+            for month, batch in by_month.items():
+                _write_durably(self.partition_path(room_id, month), _encode(batch), "ab")
+            self._update_index(room_id, by_month)
+            with self.engine.begin() as conn:
+                conn.execute(delete(Message).where(Message.id.in_([row["id"] for row in rows])))
+            moved += len(rows)
+            touched.update(by_month)
+            if len(rows) < len(fetched) or len(fetched) < self.batch_rows:
+                break
+        for month in sorted(touched):
+            if month_end(month) <= cutoff:
+                self.compact(room_id, month)
+        return moved
+
+    def _update_index(self, room_id: str, by_month: dict):
+        path = os.path.join(self.room_dir(room_id), INDEX_FILE)
+        index = read_index(path) if os.path.exists(path) else {"room_id": room_id, "partitions": {}}
+        for month, rows in by_month.items():
+            info = index["partitions"].get(month)
+            if info is None:
+                index["partitions"][month] = partition_info(rows, compacted=False)
+                continue
+            added = partition_info(rows, compacted=False)
+            info["rows"] += added["rows"]
+            info["first_seq"] = min(info["first_seq"], added["first_seq"])
+            info["last_seq"] = max(info["last_seq"], added["last_seq"])
+            info["first"] = min(info["first"], added["first"])
+            info["last"] = max(info["last"], added["last"])
+            info["compacted"] = False
+        self._replace(path, json.dumps(index, indent=1).encode("utf-8"))
+
+    def compact(self, room_id: str, month: str):
+        """Rewrite a closed month as one sorted gzip member without duplicates"""
+        path = self.partition_path(room_id, month)
+        rows = read_partition(path)
+        self._replace(path, _encode(rows))
+        index_path = os.path.join(self.room_dir(room_id), INDEX_FILE)
+        index = read_index(index_path)
+        index["partitions"][month] = partition_info(rows, compacted=True)
+        self._replace(index_path, json.dumps(index, indent=1).encode("utf-8"))
+        self.partitions_compacted += 1
+
+    @staticmethod
+    def _replace(path: str, data: bytes):
+        """Readers see either the old or the new file, never half of one"""
+        tmp = f"{path}.tmp"
+        _write_durably(tmp, data)
+        os.replace(tmp, path)
+
+    # ------------------------
+    # background task
+    # ------------------------
+    def start(self):
+        if self.task is None or self.task.done():
+            self.closing = False
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self.closing:
+            start = time.perf_counter()
+            try:
+                # blocking file and database work, kept off the event loop
+                moved = await asyncio.to_thread(self.maintain)
+            except Exception:
+                self.failures += 1
+                logger.exception("message archiving failed")
+            else:
+                self.runs += 1
+                self.rows_archived += moved
+                self.last_run_seconds = time.perf_counter() - start
+                if moved:
+                    logger.info("archived messages", extra={"rows": moved, "seconds": round(self.last_run_seconds, 3)})
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        """Stop the background task, a batch in progress is finished first"""
+        if self.task is not None:
+            self.closing = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+
+    def stats(self):
+        return {
+            "enabled": self.max_age_days > 0,
+            "max_age_days": self.max_age_days,
+            "runs": self.runs,
+            "failures": self.failures,
+            "rows_archived": self.rows_archived,
+            "partitions_compacted": self.partitions_compacted,
+            "tombstones_pruned": self.tombstones_pruned,
+            "last_run_ms": round(self.last_run_seconds * 1000, 3),
+            "cache": self.cache.stats(),
+        }
+
+
+message_archive = MessageArchive(engine)
@@ -1,14 +1,93 @@
-from sqlalchemy import create_engine 
-from sqlalchemy.orm import  sessionmaker , declarative_base
+import hashlib
+import itertools
 
-DATABASE_URL = 'sqlite:///./chat.db'
-engine = create_engine(DATABASE_URL , connect_args={"check_same_thread": False})
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import  sessionmaker , declarative_base, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.requests import HTTPConnection
+
+from Database.config import (DATABASE_URL, DATABASE_REPLICA_URLS, READ_AFTER_WRITE_SECONDS, REPLICA_PRAGMAS,
+                             async_url, engine_options, apply_sqlite_pragmas)
+from utils.cache import TTLCache
+
+# same database through the async driver for the async handlers
+ASYNC_DATABASE_URL = async_url(DATABASE_URL)
+STICKY_CACHE_SIZE = 100000
+
+engine = create_engine(DATABASE_URL , **engine_options(DATABASE_URL))
+apply_sqlite_pragmas(engine)
 sessionLocal = sessionmaker(bind = engine , autoflush=False , autocommit = False )
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+apply_sqlite_pragmas(async_engine.sync_engine)
+asyncSessionLocal = async_sessionmaker(bind = async_engine , autoflush=False , expire_on_commit=False)
+
+replica_engines = []
+for replica_url in DATABASE_REPLICA_URLS:
+    replica_engine = create_engine(replica_url, **engine_options(replica_url))
+    apply_sqlite_pragmas(replica_engine, REPLICA_PRAGMAS)
+    replica_engines.append(replica_engine)
+# sessions on a replica carry info["replica"] so callers can tell the data may lag
+replicaSessions = [sessionmaker(bind=replica_engine, autoflush=False, autocommit=False, info={"replica": True})
+                   for replica_engine in replica_engines]
+_replica_turn = itertools.count()
+
+# sha256(token) of callers that wrote within READ_AFTER_WRITE_SECONDS
+recent_writers = TTLCache(STICKY_CACHE_SIZE, READ_AFTER_WRITE_SECONDS)
 Base = declarative_base()
 
-def get_db() :
+
+def sticky_key(token: str) -> str:
+    """Same digest as Routers.auth.token_digest, one caller = one token"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def bearer_token(connection: HTTPConnection | None) -> str | None:
+    if connection is None:
+        return None
+    scheme, _, token = connection.headers.get("authorization", "").partition(" ")
+    return token if scheme.lower() == "bearer" and token else None
+
+
+def mark_write(key: str | None):
+    """Route the caller's reads to the primary until the replicas have caught up"""
+    if key is not None and replicaSessions:
+        recent_writers.set(key, True)
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_writer(session):
+    mark_write(session.info.get("sticky_key"))
+
+
+def _tag_writer(db, connection: HTTPConnection | None):
+    token = bearer_token(connection)
+    if token is not None:
+        db.info["sticky_key"] = sticky_key(token)
+
+
+def get_db(connection: HTTPConnection = None) :
+    """Session on the primary, for routes that write"""
     db = sessionLocal()
-    try : 
-        yield db 
-    finally : 
+    _tag_writer(db, connection)
+    try :
+        yield db
+    finally :
         db.close()
+
+def get_read_db(connection: HTTPConnection = None) :
+    """Session for read-only routes: a replica, or the primary right after the caller's own write"""
+    token = bearer_token(connection)
+    if not replicaSessions or (token is not None and recent_writers.get(sticky_key(token))):
+        db = sessionLocal()
+    else:
+        db = replicaSessions[next(_replica_turn) % len(replicaSessions)]()
+    try :
+        yield db
+    finally :
+        db.close()
+
+async def get_async_db(connection: HTTPConnection = None) :
+    async with asyncSessionLocal() as db :
+        _tag_writer(db, connection)
+        yield db
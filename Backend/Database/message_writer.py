@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from Database.db import async_engine
+from Database.sequence import create_sequence_allocator
+from models.message import Message
+from utils.metrics import message_flush_duration, message_persist_latency
+
+logger = logging.getLogger(__name__)
+
+# a batch is written every FLUSH_INTERVAL_MS or as soon as FLUSH_MAX_ROWS are pending
+FLUSH_INTERVAL_MS = 50
+FLUSH_MAX_ROWS = 500
+# a failed flush is retried after a delay that doubles from FLUSH_INTERVAL_MS up to this
+FLUSH_RETRY_MAX_MS = 5000
+# rows the database rejected, kept for inspection (every one is also logged)
+QUARANTINE_MAX_ROWS = 1000
+
+
+class MessageWriter:
+    """Write-behind persistence for chat messages.
+
+    Messages get their id, timestamp and seq on submit so they can be
+    broadcast straight away, the rows are inserted later in batches with one
+    executemany per flush.
+
+    Queued messages have already been delivered, so they are never dropped.
+    A flush that fails is retried with exponential backoff until the
+    database is back, including on shutdown. Only rows the database rejects
+    (IntegrityError, DataError) are set aside: the batch is written row by
+    row and the rejected rows go to the quarantine.
+    """
+
+    def __init__(self, engine, interval_ms: int = FLUSH_INTERVAL_MS, max_rows: int = FLUSH_MAX_ROWS,
+                 retry_max_ms: int = FLUSH_RETRY_MAX_MS):
+        self.engine = engine
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        self.retry_max = retry_max_ms / 1000
+        self.sequences = create_sequence_allocator(engine)
+        self.pending = []
+        self.attempts = 0
+        self.retry_at = 0.0
+        self.quarantine = deque(maxlen=QUARANTINE_MAX_ROWS)
+        self.task = None
+        self.wakeup = None
+        self.lock = None
+        self.closing = False
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.failures = 0
+        self.quarantined = 0
+        self.flush_total = 0.0
+        self.flush_max = 0.0
+        self.flush_last = 0.0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.closing = False
+            self.wakeup = asyncio.Event()
+            self.lock = asyncio.Lock()
+            self.task = asyncio.create_task(self._run())
+
+    async def submit(self, room_id: str, sender: str, content: str) -> dict:
+        """Queue a message for persistence and return the row that will be written.
+
+        Raises LookupError when the room no longer exists and
+        SequenceUnavailable when no seq can be allocated.
+        """
+        seq = await self.sequences.next(room_id)
+        row = {
+            "id": str(uuid.uuid1()),
+            "room_id": room_id,
+            "sender": sender,
+            "content": content,
+            "timestamp": datetime.utcnow(),
+            "seq": seq,
+        }
+        self.start()
+        self.pending.append(row)
+        if len(self.pending) >= self.max_rows:
+            self.wakeup.set()
+        return row
+
+    def pending_for(self, room_id: str) -> list:
+        """Rows of a room that are queued but not written yet, oldest first"""
+        return [row for row in list(self.pending) if row["room_id"] == room_id]
+
+    def is_pending(self, message_id: str) -> bool:
+        return any(row["id"] == message_id for row in self.pending)
+
+    def retry_delay(self) -> float:
+        """Seconds until the next flush, doubling with every failed attempt"""
+        if not self.attempts:
+            return self.interval
+        return min(self.interval * 2 ** self.attempts, self.retry_max)
+
+    async def _run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.retry_delay())
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            # a full queue does not cut a backoff short
+            if self.attempts and time.monotonic() < self.retry_at:
+                continue
+            await self.flush()
+
+    async def _write(self, rows: list):
+        start = time.perf_counter()
+        async with self.engine.begin() as conn:
+            await conn.execute(Message.__table__.insert(), rows)
+            await self.sequences.record(conn, rows)
+        elapsed = time.perf_counter() - start
+        self.flushes += 1
+        self.rows_flushed += len(rows)
+        self.flush_total += elapsed
+        self.flush_last = elapsed
+        self.flush_max = max(self.flush_max, elapsed)
+        message_flush_duration.observe(elapsed)
+        written_at = datetime.utcnow()
+        for row in rows:
+            message_persist_latency.observe((written_at - row["timestamp"]).total_seconds())
+
+    async def _write_rows(self, batch: list):
+        """Write a rejected batch row by row, quarantining the rows the database refuses"""
+        for row in batch:
+            try:
+                await self._write([row])
+            except (IntegrityError, DataError) as e:
+                self.quarantined += 1
+                self.quarantine.append({"row": row, "error": str(e.orig)})
+                logger.error("message rejected by the database, quarantined",
+                             extra={"message_id": row["id"], "room_id": row["room_id"], "seq": row["seq"],
+                                    "sender": row["sender"], "error": str(e.orig)})
+            # the row is at the head of the queue, written or set aside
+            del self.pending[0]
+
+    async def flush(self):
+        """Write everything queued. Returns with rows still queued after a failure, to be retried later."""
+        async with self.lock:
+            while self.pending:
+                batch = self.pending[:self.max_rows]
+                try:
+                    try:
+                        await self._write(batch)
+                        del self.pending[:len(batch)]
+                    except (IntegrityError, DataError):
+                        await self._write_rows(batch)
+                except Exception as e:
+                    # the database is unreachable or busy, keep the rows and back off
+                    self.failures += 1
+                    self.attempts += 1
+                    self.retry_at = time.monotonic() + self.retry_delay()
+                    logger.warning("message flush failed, retrying",
+                                   extra={"rows": len(self.pending), "attempts": self.attempts,
+                                          "retry_in_ms": round(self.retry_delay() * 1000), "error": repr(e)})
+                    return
+                self.attempts = 0
+
+    async def close(self):
+        """Stop the background task and write out everything still queued"""
+        if self.task is not None:
+            self.closing = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+        if self.pending:
+            self.lock = self.lock or asyncio.Lock()
+            # messages were already delivered, keep retrying until the database takes them
+            while self.pending:
+                await self.flush()
+                if self.pending:
+                    await asyncio.sleep(self.retry_delay())
+
+    def stats(self):
+        return {
+            "queue_depth": len(self.pending),
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "failures": self.failures,
+            "retry_attempts": self.attempts,
+            "quarantined": self.quarantined,
+            "avg_flush_ms": round(self.flush_total / self.flushes * 1000, 3) if self.flushes else 0.0,
+            "max_flush_ms": round(self.flush_max * 1000, 3),
+            "last_flush_ms": round(self.flush_last * 1000, 3),
+            "seq_reservations": self.sequences.reservations,
+        }
+
+
+message_writer = MessageWriter(async_engine)
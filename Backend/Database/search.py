@@ -0,0 +1,128 @@
+"""Full-text search over chat messages.
+
+SQLite keeps an external-content FTS5 table, message_fts, whose rowids are
+the message rowids. Triggers on message keep it in step with every insert,
+update and delete, including the write-behind batches. Postgres gets a
+generated tsvector column with a GIN index instead.
+
+message has a TEXT primary key, so VACUUM may renumber its rowids and leave
+the index pointing at the wrong messages. ensure_search_index() runs at
+startup and rebuilds the index when the highest indexed rowid no longer
+matches the table's. VACUUM while the app is stopped, or call
+rebuild_search_index() right after.
+"""
+import re
+
+from sqlalchemy import text
+
+MAX_QUERY_TERMS = 16
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+
+# keyed on message.rowid, which VACUUM may renumber, see search_index_stale()
+SQLITE_SETUP = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+    "content, content='message', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN "
+    "INSERT INTO message_fts(rowid, content) VALUES (new.rowid, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.rowid, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.rowid, old.content); "
+    "INSERT INTO message_fts(rowid, content) VALUES (new.rowid, new.content); END",
+]
+
+POSTGRES_SETUP = [
+    "ALTER TABLE message ADD COLUMN IF NOT EXISTS search tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_message_search ON message USING GIN (search)",
+]
+
+# bm25() is lower for better matches, ts_rank() higher
+SQLITE_SEARCH = """
+SELECT m.id, m.room_id, m.sender, m.content, m.timestamp, m.seq, bm25(message_fts) AS rank,
+       snippet(message_fts, 0, '[', ']', '...', 12) AS snippet
+FROM message_fts
+JOIN message m ON m.rowid = message_fts.rowid
+JOIN room r ON r.id = m.room_id
+JOIN server_user su ON su.server_id = r.server_id AND su.user_id = :user_id
+WHERE message_fts MATCH :query {filters}
+ORDER BY rank, m.timestamp DESC
+LIMIT :limit OFFSET :offset
+"""
+
+POSTGRES_SEARCH = """
+SELECT m.id, m.room_id, m.sender, m.content, m.timestamp, m.seq, ts_rank(m.search, q) AS rank,
+       ts_headline('simple', m.content, q, 'StartSel=[, StopSel=], MaxWords=12, MinWords=4') AS snippet
+FROM message m
+CROSS JOIN plainto_tsquery('simple', :query) q
+JOIN room r ON r.id = m.room_id
+JOIN server_user su ON su.server_id = r.server_id AND su.user_id = :user_id
+WHERE m.search @@ q {filters}
+ORDER BY rank DESC, m.timestamp DESC
+LIMIT :limit OFFSET :offset
+"""
+
+
+def ensure_search_index(engine):
+    """Create the search index and its triggers if missing, backfilling existing messages"""
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if dialect == "sqlite":
+            existed = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'").first()
+            for statement in SQLITE_SETUP:
+                conn.exec_driver_sql(statement)
+            if not existed or search_index_stale(conn):
+                conn.exec_driver_sql("INSERT INTO message_fts(message_fts) VALUES ('rebuild')")
+        elif dialect == "postgresql":
+            for statement in POSTGRES_SETUP:
+                conn.exec_driver_sql(statement)
+
+
+def search_index_stale(conn) -> bool:
+    """Whether message rowids were renumbered since the index was built.
+
+    The triggers keep message_fts_docsize at one row per message rowid.
+    VACUUM closes the gaps deletes and the archiver leave, which lowers the
+    table's highest rowid below the index's. Both are primary key lookups.
+    """
+    indexed = conn.exec_driver_sql("SELECT max(id) FROM message_fts_docsize").scalar()
+    current = conn.exec_driver_sql("SELECT max(rowid) FROM message").scalar()
+    return indexed != current
+
+
+def rebuild_search_index(engine):
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO message_fts(message_fts) VALUES ('rebuild')")
+
+
+def search_terms(query: str) -> list[str]:
+    return re.findall(r"\w+", query)[:MAX_QUERY_TERMS]
+
+
+def fts_query(terms: list[str]) -> str:
+    """Every term quoted, so user input can never use FTS5 operators, all of them must match"""
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def search_messages(db, user_id: str, query: str, limit: int = SEARCH_PAGE_SIZE, offset: int = 0,
+                    server_id: str | None = None, room_id: str | None = None) -> list:
+    """Ranked messages matching `query` in the servers `user_id` belongs to, best first"""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    params = {"user_id": user_id, "limit": limit, "offset": offset}
+    filters = ""
+    if server_id is not None:
+        filters += " AND r.server_id = :server_id"
+        params["server_id"] = server_id
+    if room_id is not None:
+        filters += " AND m.room_id = :room_id"
+        params["room_id"] = room_id
+    if db.get_bind().dialect.name == "postgresql":
+        statement, params["query"] = POSTGRES_SEARCH, " ".join(terms)
+    else:
+        statement, params["query"] = SQLITE_SEARCH, fts_query(terms)
+    return db.execute(text(statement.format(filters=filters)), params).mappings().all()
@@ -0,0 +1,151 @@
+"""Per-room message sequence numbers.
+
+With the in-process broker there is one worker. room.last_seq is the
+highest seq reserved in a room, and the worker reserves SEQ_BLOCK_SIZE
+numbers with one UPDATE ... RETURNING and hands them out from memory, so
+only one message in a block waits for the database. Numbers left in a block
+when the worker stops are never used, so seqs increase but can have gaps.
+
+With a Redis broker there are several workers, and blocks reserved by
+different workers would interleave and stop following send order. Every
+seq comes from INCR on the room's counter key instead, one round trip and
+no database write per message. A worker seeds the key with SET NX from
+room.last_seq the first time it uses a room, and the message writer raises
+room.last_seq to the highest seq it flushes, so a counter Redis lost
+continues from the database. Seqs issued but not flushed when Redis loses
+its data can be handed out twice. The unique index rejects the second row
+and the writer quarantines it, so Redis should persist its data.
+
+With several workers a seq can also be written after a higher one: worker
+A still has seq N queued while worker B has already flushed N + 1. Readers
+walking forward by seq (GET /messages?after=, /sync) only see their own
+worker's queue, so they stop at messages younger than SEQ_SETTLE_MS. By
+then every lower seq has been flushed, unless flushes fail for longer or
+worker clocks drift apart by more than the window.
+"""
+import asyncio
+import logging
+import os
+
+from sqlalchemy import case, select, update
+
+from models.room import Room
+from utils.resp import SharedConnection
+from ws.broker import BROKER_URL
+
+logger = logging.getLogger(__name__)
+
+SEQ_BLOCK_SIZE = int(os.getenv("SEQ_BLOCK_SIZE", "100"))
+# a few flush intervals and retries, a single worker sees its whole queue and needs none
+SEQ_SETTLE_MS = int(os.getenv("SEQ_SETTLE_MS", "0" if BROKER_URL.startswith("memory") else "1000"))
+SEQ_PREFIX = "pingspace:seq:"
+
+
+class SequenceUnavailable(Exception):
+    """No seq could be allocated right now, the message was not sent"""
+
+
+class SequenceAllocator:
+    """Hands out increasing per-room seqs from blocks reserved in room.last_seq"""
+
+    def __init__(self, engine, block_size: int = SEQ_BLOCK_SIZE):
+        self.engine = engine
+        self.block_size = block_size
+        self.blocks = {}  # room_id -> [next seq, last seq of the block]
+        # one lock per room, a reservation only holds up its own room
+        self.locks = {}
+        self.reservations = 0
+
+    async def next(self, room_id: str) -> int:
+        """The room's next seq, raises LookupError when the room does not exist"""
+        block = self.blocks.get(room_id)
+        if block is None or block[0] > block[1]:
+            lock = self.locks.setdefault(room_id, asyncio.Lock())
+            async with lock:
+                # another message may have reserved a block while we waited
+                block = self.blocks.get(room_id)
+                if block is None or block[0] > block[1]:
+                    last = await self._reserve(room_id)
+                    block = self.blocks[room_id] = [last - self.block_size + 1, last]
+        seq = block[0]
+        block[0] += 1
+        return seq
+
+    async def _reserve(self, room_id: str) -> int:
+        async with self.engine.begin() as conn:
+            last = (await conn.execute(update(Room).where(Room.id == room_id).
+                                       values(last_seq=Room.last_seq + self.block_size).
+                                       returning(Room.last_seq))).scalar()
+        if last is None:
+            raise LookupError(f"Room {room_id} not found")
+        self.reservations += 1
+        return last
+
+    async def record(self, conn, rows: list):
+        """Called in the writer's flush transaction, room.last_seq is already past every block"""
+
+    def drop(self, room_id: str):
+        self.blocks.pop(room_id, None)
+        self.locks.pop(room_id, None)
+
+
+class RedisSequenceAllocator:
+    """Hands out increasing per-room seqs from INCR on a Redis-protocol server"""
+
+    def __init__(self, engine, url: str, prefix: str = SEQ_PREFIX):
+        self.engine = engine
+        self.prefix = prefix
+        self.redis = SharedConnection(url)
+        # room_id -> highest seq this worker knows is in room.last_seq, the counter's seed
+        self.floors = {}
+        self.reservations = 0
+
+    async def next(self, room_id: str) -> int:
+        """The room's next seq.
+
+        Raises LookupError when the room does not exist and
+        SequenceUnavailable when the server cannot be reached.
+        """
+        floor = self.floors.get(room_id)
+        if floor is None:
+            last = await self._last_seq(room_id)
+            # a flush may have raised the floor while the room was read
+            floor = self.floors[room_id] = max(last, self.floors.get(room_id, 0))
+        key = self.prefix + room_id
+        try:
+            _, seq = await self.redis.pipeline(("SET", key, floor, "NX"), ("INCR", key))
+        except Exception as e:
+            logger.warning("seq allocation failed", extra={"room_id": room_id, "error": repr(e)})
+            raise SequenceUnavailable(room_id) from e
+        self.reservations += 1
+        return seq
+
+    async def _last_seq(self, room_id: str) -> int:
+        async with self.engine.connect() as conn:
+            last = (await conn.execute(select(Room.last_seq).where(Room.id == room_id))).first()
+        if last is None:
+            raise LookupError(f"Room {room_id} not found")
+        return last[0] or 0
+
+    async def record(self, conn, rows: list):
+        """Raise room.last_seq to the highest flushed seq, in the writer's flush transaction"""
+        highest = {}
+        for row in rows:
+            highest[row["room_id"]] = max(row["seq"], highest.get(row["room_id"], 0))
+        for room_id, seq in highest.items():
+            result = await conn.execute(update(Room).where(Room.id == room_id).
+                                        values(last_seq=case((Room.last_seq < seq, seq), else_=Room.last_seq)))
+            if result.rowcount:
+                self.floors[room_id] = max(seq, self.floors.get(room_id, 0))
+            else:
+                # deleted on another worker, the next message reads the room again and gets LookupError
+                self.floors.pop(room_id, None)
+
+    def drop(self, room_id: str):
+        self.floors.pop(room_id, None)
+
+
+def create_sequence_allocator(engine, url: str = BROKER_URL):
+    if url.startswith("redis://"):
+        return RedisSequenceAllocator(engine, url)
+    return SequenceAllocator(engine)
@@ -8,33 +8,49 @@ from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import Annotated
-from Database.db import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from Database.db import get_db, get_async_db
 from models.user import User
 from schemas.user_schema import UserOut, UserResponse , UserCreate
+from utils.cache import TTLCache
+from utils.password_pool import PasswordPool
+import hashlib
+import time
 
 
 SECRET_KEY = "key" 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60  
-
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
+TOKEN_CACHE_SIZE = 10000
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL_SECONDS = 300
+# bcrypt cost factor, hashes made with another cost are upgraded on the next login
+BCRYPT_ROUNDS = 12
+
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+password_pool = PasswordPool(pwd_context)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 router = APIRouter(tags=["auth"])
+
+# sha256(token) -> verified payload, an entry never outlives the token's exp
+token_cache = TTLCache(TOKEN_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+# user id -> detached User row, dropped by update_user / delete_user
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
 # db_dependencies = Annotated[Session, Depends(get_db)]
 
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await password_pool.hash(password)
 
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+async def verify_password(plain: str, hashed: str) -> tuple[bool, str | None]:
+    return await password_pool.verify_and_update(plain, hashed)
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
-    print(data)
     expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     token = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
@@ -43,10 +59,53 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
 
 
 
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def decode_token(token: str) -> dict:
+    """Verified JWT payload, raises JWTError. Cached so the HMAC is checked once per token"""
+    key = token_digest(token)
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        ttl = payload.get("exp", 0) - time.time()
+        if ttl > 0:
+            token_cache.set(key, payload, ttl=min(ttl, token_cache.ttl))
+    return payload
+
+
+def load_user(db: Session, user_id: str) -> User | None:
+    user = user_cache.get(user_id)
+    if user is None:
+        generation = user_cache.generation
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is not None:
+            # detach so the row can be shared between requests
+            db.expunge(user)
+            user_cache.set(user_id, user, generation=generation)
+    return user
+
+
+async def load_user_async(db: AsyncSession, user_id: str) -> User | None:
+    user = user_cache.get(user_id)
+    if user is None:
+        generation = user_cache.generation
+        user = (await db.execute(select(User).filter(User.id == user_id))).scalars().first()
+        if user is not None:
+            db.expunge(user)
+            user_cache.set(user_id, user, generation=generation)
+    return user
+
+
+def invalidate_user(user_id: str):
+    user_cache.invalidate(user_id)
+
+
 def decode_access_token(token: str):
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
@@ -63,7 +122,7 @@ def decode_access_token(token: str):
 
 def get_current_user(token: str = Depends(oauth2_scheme), db : Session = Depends(get_db)) -> User:
     user_id = decode_access_token(token)
-    user = db.query(User).filter(User.id == user_id).first()
+    user = load_user(db, user_id)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="User not found",
@@ -72,25 +131,32 @@ def get_current_user(token: str = Depends(oauth2_scheme), db : Session = Depends
 
 
 @router.post("/signup", response_model= UserResponse)
-def signup(user: UserCreate, db: Session = Depends(get_db)):
-    existing_user = db.query(User).filter(User.username == user.username).first()
+async def signup(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    existing_user = (await db.execute(select(User.id).filter(User.username == user.username))).first()
     if existing_user:
         raise HTTPException(status_code=409, detail="Username already exists")
     
-    hashed_password = hash_password(user.password)
+    hashed_password = await hash_password(user.password)
     new_user = User(username=user.username, password=hashed_password)
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
     return new_user
 
 
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(User).filter(User.username == form_data.username))).scalars().first()
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await verify_password(form_data.password, user.password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # stored hash used an old cost factor, upgrade it transparently
+        user.password = new_hash
+        await db.commit()
+        invalidate_user(user.id)
     
     token = create_access_token(data={"sub": str(user.id) , "username" : user.username})
     return {"access_token": token, "token_type": "bearer"}
@@ -1,4 +1,8 @@
 # Routers/main.py
+import json
+import logging
+import time
+
 from fastapi import (
     APIRouter,
     Depends,
@@ -9,28 +13,50 @@ from fastapi import (
     status
 )
 from jose.exceptions import JWTError
+import uuid
+from datetime import datetime, timedelta
+from itertools import takewhile
+
+from sqlalchemy import func, insert, select
 from sqlalchemy.orm import Session
-from Database.db import get_db
-from jose import jwt
+from sqlalchemy.ext.asyncio import AsyncSession
+from Database.db import get_db, get_read_db, get_async_db, asyncSessionLocal, sessionLocal, mark_write
 
 from models.user import User
 from models.room import Room
 from models.message import Message
 from models.server import Server
 from models.serveruser import ServerUser
+from models.tombstone import MessageTombstone
 
 from schemas.user_schema import UserOut, UserUpdate
-from schemas.room_schema import RoomCreate, RoomResponse, RoomUpdate
+from schemas.room_schema import RoomCreate, RoomResponse, RoomUpdate, RoomBulkCreate
 from schemas.server_schema import ServerCreate, ServerResponse, ServerUpdate , UsersList
-from schemas.message_schema import MessageResponse, MessageCreate
-from schemas.server_user_schema import ServerUserCreate, ServerUserResponse
+from schemas.message_schema import MessageResponse, MessageCreate, MessagePage, SearchPage, SyncRequest, SyncRoom, SyncResponse
+from schemas.server_user_schema import ServerUserCreate, ServerUserResponse, ServerUserBulkCreate, ServerUserBulkResponse
 from Routers.auth import hash_password
 
-from ws.connection_manager import manager
-from Routers.auth import get_current_user, SECRET_KEY, ALGORITHM
-from datetime import datetime, timedelta
-from collections import defaultdict
+from ws.connection_manager import manager, is_heartbeat
+from ws.recent_messages import recent_messages, RECENT_MESSAGES_PER_ROOM
+from Database.message_writer import message_writer
+from Database.sequence import SEQ_SETTLE_MS, SequenceUnavailable
+from Database.archive import message_archive, TOMBSTONE_RETENTION_DAYS
+from Database.search import search_messages, SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE
+from Routers.auth import get_current_user, decode_token, load_user_async, invalidate_user, token_digest
+from utils.pagination import encode_cursor, decode_cursor, encode_stamped_cursor, decode_stamped_cursor
+from utils.membership import get_role, get_role_async, invalidate_membership
+from utils.rate_limit import rate_limiter
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+# rows accepted by one bulk request, well under SQLite's bound parameter limit
+MAX_BULK_ITEMS = 5000
+# past these a room is too far behind to sync and the client reloads it
+SYNC_MAX_MESSAGES = 500
+SYNC_MAX_TOMBSTONES = 1000
+MAX_SYNC_ROOMS = 100
 
 # ------------------------
 # USERS - Full CRUD
@@ -51,11 +77,10 @@ def get_user(user_id: str, db: Session = Depends(get_db), current_user: User = D
     return user
 
 @router.put("/users/{user_id}", response_model=UserOut , tags = ['user'])
-def update_user(user_id: str, payload: UserUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def update_user(user_id: str, payload: UserUpdate, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
     if not current_user.id == user_id :
         raise HTTPException(status.HTTP_401_UNAUTHORIZED)
-    user = db.query(User).filter(User.username == payload.username).first()
+    user = (await db.execute(select(User).filter(User.id == user_id))).scalars().first()
     
         
     if not user:
@@ -64,10 +89,9 @@ def update_user(user_id: str, payload: UserUpdate, db: Session = Depends(get_db)
         user.username = payload.username
     
     if payload.password:
-        user.password = hash_password(payload.password)
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+        user.password = await hash_password(payload.password)
+    await db.commit()
+    invalidate_user(user.id)
     return user 
 
 @router.delete("/users/{user_id}" , tags = ['user'])
@@ -83,6 +107,8 @@ def delete_user(user_id: str, db: Session = Depends(get_db), current_user: User
     
         db.delete(user)
         db.commit()
+        invalidate_user(user_id)
+        invalidate_membership(user_id=user_id)
         return {"detail": "User deleted successfully"}
     raise HTTPException(status.HTTP_401_UNAUTHORIZED)
 
@@ -93,35 +119,31 @@ def delete_user(user_id: str, db: Session = Depends(get_db), current_user: User
 def create_server(data: ServerCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     if not data.name or data.name.strip() == "" :
         raise HTTPException(status.HTTP_400_BAD_REQUEST , detail = "Please enter the server name")
-    new_server = Server(name=data.name, admin_id=current_user.id)
-    db.add(new_server)
-    db.commit()
-    db.refresh(new_server)
-    # add admin as server user
-    admin_link = ServerUser(user_id=current_user.id, server_id=new_server.id, role="admin")
-    db.add(admin_link)
+    # server and admin link in one transaction, the id is generated client side
+    new_server = {"id": str(uuid.uuid1()), "name": data.name, "admin_id": current_user.id}
+    db.execute(insert(Server), [new_server])
+    db.execute(insert(ServerUser), [{"id": str(uuid.uuid1()), "user_id": current_user.id,
+                                     "server_id": new_server["id"], "role": "admin"}])
     db.commit()
+    invalidate_membership(current_user.id, new_server["id"])
     return new_server
 
-@router.get("/servers", tags = ['server'])
-def get_servers(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-
-    server_ids = [su.server_id for su in db.query(ServerUser).filter(ServerUser.user_id == current_user.id).all()]
-    # servers = db.query(Server).\
-    # join(ServerUser , Server.id == ServerUser.server_id).filter(ServerUser.user_id == current_user.id).all()
-    # return servers
-    return db.query(Server).filter(Server.id.in_(server_ids)).all()
-
-
-    
+@router.get("/servers", response_model=list[ServerResponse], tags = ['server'])
+def get_servers(db: Session = Depends(get_read_db), current_user: User = Depends(get_current_user)):
+    # one joined query, columns only
+    return db.execute(
+        select(Server.id, Server.name, Server.admin_id)
+        .join(ServerUser, Server.id == ServerUser.server_id)
+        .filter(ServerUser.user_id == current_user.id)
+    ).all()
 
 @router.get("/servers/{server_id}", response_model=ServerResponse, tags = ['server'])
 def get_server(server_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    server = db.query(Server).filter(Server.id == server_id).first()
+    server = db.execute(select(Server.id, Server.name, Server.admin_id).filter(Server.id == server_id)).first()
     if not server:
         raise HTTPException(404, "Server not found")
     # check membership
-    if not db.query(ServerUser).filter(ServerUser.server_id == server_id, ServerUser.user_id == current_user.id).first():
+    if get_role(db, current_user.id, server_id) is None:
         raise HTTPException(status_code=403, detail="Not a member of this server")
     return server
 
@@ -155,18 +177,17 @@ def delete_server(server_id: str, db: Session = Depends(get_db), current_user: U
 
     db.delete(server)
     db.commit()
+    invalidate_membership(server_id=server_id)
     return {"detail": "Server deleted successfully"}
 
 # ------------------------
 # ROOMS - CRUD
 # ------------------------
-@router.post("/rooms", tags = ['room'])
-async def create_room(data: RoomCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    server = db.query(Server.admin_id).filter(Server.id == data.server_id).first()
+@router.post("/rooms", response_model=RoomResponse, tags = ['room'])
+async def create_room(data: RoomCreate, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    server = (await db.execute(select(Server.admin_id).filter(Server.id == data.server_id))).first()
 
-    admin_check = db.query(ServerUser).filter(ServerUser.server_id == data.server_id, 
-                                                ServerUser.user_id == current_user.id, 
-                                                ServerUser.role == "admin").first()
+    admin_check = await get_role_async(db, current_user.id, data.server_id) == "admin"
     # name = db.query(User.username).join(ServerUser , User.id == ServerUser.user_id).\
     #     filter(ServerUser.server_id == data.server_id).first()
     # return name
@@ -175,12 +196,11 @@ async def create_room(data: RoomCreate, db: Session = Depends(get_db), current_u
 
     if not admin_check:
         raise HTTPException(status_code=403, detail="only admin can make the room")
-    if db.query(Room).filter(Room.server_id == data.server_id, Room.name == data.name).first():
+    if (await db.execute(select(Room.id).filter(Room.server_id == data.server_id, Room.name == data.name))).first():
         raise HTTPException(status_code=400, detail="Room already exists")
     new_room = Room(name=data.name, description=data.description or "", server_id=data.server_id)
     db.add(new_room)
-    db.commit()
-    db.refresh(new_room)
+    await db.commit()
     
     # Broadcast room creation event to all users in the server
     room_data = {
@@ -196,18 +216,54 @@ async def create_room(data: RoomCreate, db: Session = Depends(get_db), current_u
     
     return new_room
 
+@router.post("/rooms/bulk", response_model=list[RoomResponse], tags = ['room'])
+async def create_rooms_bulk(data: RoomBulkCreate, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    """Create many rooms in one transaction and announce them with a single rooms_created event"""
+    if not data.rooms:
+        raise HTTPException(400, "No rooms given")
+    if len(data.rooms) > MAX_BULK_ITEMS:
+        raise HTTPException(400, f"At most {MAX_BULK_ITEMS} rooms per request")
+    if not (await db.execute(select(Server.id).filter(Server.id == data.server_id))).first():
+        raise HTTPException(status_code=404, detail="Server not found")
+    if await get_role_async(db, current_user.id, data.server_id) != "admin":
+        raise HTTPException(status_code=403, detail="only admin can make the room")
+
+    names = [room.name for room in data.rooms]
+    if any(not name or not name.strip() for name in names):
+        raise HTTPException(400, "Please enter the room name")
+    if len(set(names)) != len(names):
+        raise HTTPException(400, "Duplicate room names in request")
+    # one query for every name that is already taken in the server
+    taken = (await db.execute(
+        select(Room.name).filter(Room.server_id == data.server_id, Room.name.in_(names))
+    )).scalars().all()
+    if taken:
+        raise HTTPException(status_code=400, detail=f"Rooms already exist: {', '.join(sorted(taken))}")
+
+    rows = [
+        {"id": str(uuid.uuid1()), "name": room.name, "description": room.description or "", "server_id": data.server_id}
+        for room in data.rooms
+    ]
+    await db.execute(insert(Room), rows)
+    await db.commit()
+
+    await manager.broadcast_to_server(str(data.server_id), {"type": "rooms_created", "rooms": rows})
+    return rows
+
 @router.get("/rooms/{server_id}", response_model=list[RoomResponse], tags = ['room'])
-def get_rooms_by_server(server_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    if not db.query(ServerUser).filter(ServerUser.server_id == server_id, ServerUser.user_id == current_user.id).first():
+def get_rooms_by_server(server_id: str, db: Session = Depends(get_read_db), current_user: User = Depends(get_current_user)):
+    if get_role(db, current_user.id, server_id) is None:
         raise HTTPException(status_code=403, detail="Not a member of server")
-    return db.query(Room).filter(Room.server_id == server_id).all()
+    return db.execute(
+        select(Room.id, Room.name, Room.description, Room.server_id).filter(Room.server_id == server_id)
+    ).all()
 
 @router.get("/room/{room_id}", response_model=RoomResponse , tags = ['room'])
 def get_room(room_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     room = db.query(Room).filter(Room.id == room_id).first()
     if not room:
         raise HTTPException(404, "Room not found")
-    if not db.query(ServerUser).filter(ServerUser.server_id == room.server_id, ServerUser.user_id == current_user.id).first():
+    if get_role(db, current_user.id, room.server_id) is None:
         raise HTTPException(status_code=403, detail="Not a member of server")
     return room
 
@@ -237,64 +293,255 @@ def delete_room(room_id: str, db: Session = Depends(get_db), current_user: User
     if server.admin_id != current_user.id:
         raise HTTPException(403, "Only server admin can delete rooms")
     db.query(Message).filter(Message.room_id == room.id).delete()
+    db.query(MessageTombstone).filter(MessageTombstone.room_id == room.id).delete()
     db.delete(room)
     db.commit()
+    recent_messages.drop(room_id)
+    message_archive.drop(room_id)
+    message_writer.sequences.drop(room_id)
     return {"detail": "Room deleted successfully"}
 
 # ------------------------
 # MESSAGES - CRUD 
 # ------------------------
-@router.post("/messages", response_model=MessageResponse , tags = ['message'])
-def post_message(payload: MessageCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)): 
-    room = db.query(Room).filter(Room.id == payload.room_id).first()
+def rate_limited(route: str):
+    """Dependency that rejects the request with 429 once the caller's bucket for `route` is empty"""
+    async def check(current_user: User = Depends(get_current_user)):
+        if not await rate_limiter.hit(route, current_user.id):
+            raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, "You're sending messages too fast. Please slow down.")
+    return check
+
+@router.post("/messages", response_model=MessageResponse , tags = ['message'], dependencies=[Depends(rate_limited("post_message"))])
+async def post_message(payload: MessageCreate, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)): 
+    room = (await db.execute(select(Room.server_id).filter(Room.id == payload.room_id))).first()
     if not room:
         raise HTTPException(404, "Room not found")
-    membership = db.query(ServerUser).filter(ServerUser.user_id == current_user.id , ServerUser.server_id == room.server_id).first() 
-    if not membership :
+    membership = await get_role_async(db, current_user.id, room.server_id)
+    if membership is None :
         raise HTTPException(status_code=401 , detail = "not member of a server")
     
     if not payload.content or len(payload.content) == 0:
         raise HTTPException(400, "Message content invalid")
-    new_msg = Message(room_id=payload.room_id, sender=current_user.username, content=payload.content)
-    
-    db.add(new_msg)
-    db.commit()
-    db.refresh(new_msg)
+    # same path as websocket messages, the writer assigns the seq and persists in the background
+    try:
+        new_msg = await message_writer.submit(payload.room_id, current_user.username, payload.content)
+    except LookupError:
+        raise HTTPException(404, "Room not found")
+    except SequenceUnavailable:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Message could not be sent, try again")
+    mark_write(db.info.get("sticky_key"))
+    # the broadcast also keeps the recent message buffer of every worker current
+    await manager.broadcast(payload.room_id, message_payload(new_msg))
     return new_msg
 
-@router.get("/messages/{room_id}", response_model=list[MessageResponse] , tags = ['message'])
-def get_history(room_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def message_dict(message: Message) -> dict:
+    return {
+        "id": message.id,
+        "room_id": message.room_id,
+        "sender": message.sender,
+        "content": message.content,
+        "timestamp": message.timestamp,
+        "seq": message.seq,
+    }
+
+
+def message_payload(message: dict) -> dict:
+    """Websocket frame for a chat message"""
+    return {"id": message["id"], "room_id": message["room_id"], "sender": message["sender"],
+            "content": message["content"], "created_at": str(message["timestamp"]), "seq": message["seq"]}
+
+
+def read_with_pending(query, room_id: str, limit: int) -> tuple[list, list]:
+    """Up to `limit` rows of a message query, and the room's rows still queued by the writer that it missed.
+
+    The queue is read before the table so a flush in between cannot lose a row.
+    """
+    pending = message_writer.pending_for(room_id)
+    rows = [message_dict(row) for row in query.limit(limit).all()]
+    stored = {row["id"] for row in rows}
+    return rows, [row for row in pending if row["id"] not in stored]
+
+
+def warm_recent_messages(db: Session, room_id: str) -> list:
+    """Load a room's latest messages into the recent message buffer, returns the room's messages newest first"""
+    # the buffer exists before the read, so messages broadcast while it runs are kept
+    buffer = recent_messages.start_warming(room_id)
+    read_at = time.monotonic()
+    try:
+        rows, pending = read_with_pending(db.query(Message).filter(Message.room_id == room_id).
+                                          order_by(Message.seq.desc()), room_id, RECENT_MESSAGES_PER_ROOM)
+    except Exception:
+        recent_messages.cancel_warming(buffer)
+        raise
+    messages = rows[::-1] + pending
+    return recent_messages.seed(room_id, buffer, messages, complete=len(rows) < RECENT_MESSAGES_PER_ROOM,
+                                read_at=read_at)
+
+
+def messages_after(db: Session, room_id: str, seq: int, limit: int) -> list:
+    """Up to `limit` messages of a room after a seq, oldest first"""
+    query = db.query(Message).filter(Message.room_id == room_id, Message.seq > seq).order_by(Message.seq.asc())
+    messages, pending = read_with_pending(query, room_id, limit)
+    pending = [row for row in pending if row["seq"] > seq]
+    # positions older than the hot table start in the archive
+    archived = message_archive.history(room_id, after=seq, limit=limit)
+    if archived or pending:
+        # a row being archived or flushed right now can be in two places, keep one
+        by_seq = {message["seq"]: message for message in archived + messages + pending}
+        messages = [by_seq[key] for key in sorted(by_seq)[:limit]]
+    if SEQ_SETTLE_MS:
+        # another worker may still hold a lower seq than a fresh row, stop before it
+        settled = datetime.utcnow() - timedelta(milliseconds=SEQ_SETTLE_MS)
+        messages = list(takewhile(lambda message: message["timestamp"] <= settled, messages))
+    return messages
+
+
+@router.get("/messages/{room_id}", response_model=MessagePage , tags = ['message'])
+def get_history(room_id: str, before: str | None = None, after: str | None = None,
+                limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+                db: Session = Depends(get_read_db), current_user: User = Depends(get_current_user)):
+    """Newest-first page of a room's history.
+
+    Without a cursor the latest messages are returned, `before` pages back
+    into older history and `after` fetches what arrived since a message.
+    """
+    if before and after:
+        raise HTTPException(400, "Use either before or after, not both")
     room = db.query(Room).filter(Room.id == room_id).first()
     if not room:
         raise HTTPException(404, "Room not found")
-    membership = db.query(ServerUser).filter(ServerUser.user_id == current_user.id , ServerUser.server_id == room.server_id).first()
+    membership = get_role(db, current_user.id, room.server_id)
 
-    if not membership:
+    if membership is None:
         raise HTTPException(403, "Not a member of server")
-    return db.query(Message).filter(Message.room_id == room_id).order_by(Message.timestamp).all()
+
+    # one extra row tells us whether there is another page
+    if not before and not after:
+        # the first page of a room comes from memory once the room is warm
+        messages = recent_messages.latest(room_id, limit + 1)
+        if messages is None:
+            if db.info.get("replica"):
+                # the buffer is kept current from here on, a lagging replica would leave a gap in it
+                with sessionLocal() as primary:
+                    messages = warm_recent_messages(primary, room_id)[:limit + 1]
+            else:
+                messages = warm_recent_messages(db, room_id)[:limit + 1]
+    elif after:
+        # walk forward from the cursor, then flip so the page is still newest first
+        messages = messages_after(db, room_id, decode_cursor(after), limit + 1)
+    else:
+        query = db.query(Message).filter(Message.room_id == room_id, Message.seq < decode_cursor(before)).\
+            order_by(Message.seq.desc())
+        messages = [message_dict(row) for row in query.limit(limit + 1).all()]
+
+    # history older than the hot table continues in the archive
+    if not after and len(messages) <= limit:
+        if messages:
+            edge = messages[-1]["seq"]
+        else:
+            edge = decode_cursor(before) if before else None
+        messages += message_archive.history(room_id, before=edge, limit=limit + 1 - len(messages))
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    next_cursor = None
+    if has_more:
+        edge = messages[-1]
+        next_cursor = encode_cursor(edge["seq"])
+    if after:
+        messages.reverse()
+    return {"messages": messages, "next_cursor": next_cursor}
+
+@router.get("/search", response_model=SearchPage, tags=['message'])
+def search(q: str = Query(..., min_length=1, max_length=256), server_id: str | None = None, room_id: str | None = None,
+           limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=MAX_SEARCH_PAGE_SIZE), offset: int = Query(0, ge=0, le=10000),
+           db: Session = Depends(get_read_db), current_user: User = Depends(get_current_user)):
+    """Ranked full-text search over the messages of every server the caller belongs to"""
+    rows = search_messages(db, current_user.id, q, limit + 1, offset, server_id=server_id, room_id=room_id)
+    has_more = len(rows) > limit
+    return {"results": rows[:limit], "next_offset": offset + limit if has_more else None}
+
+def tombstone_cursor(synced_at: datetime, tombstone_id: int) -> str:
+    return encode_stamped_cursor(synced_at, tombstone_id)
+
+
+def sync_room(db: Session, entry: SyncRoom, now: datetime) -> dict:
+    result = {"room_id": entry.room_id}
+    after_id = None
+    if entry.tombstone_cursor:
+        synced_at, tombstone_id = decode_stamped_cursor(entry.tombstone_cursor)
+        # older tombstones are pruned, deletions since then may be gone
+        if synced_at >= now - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+            after_id = tombstone_id
+
+    if after_id is not None and entry.last_seq is not None:
+        messages = messages_after(db, entry.room_id, entry.last_seq, SYNC_MAX_MESSAGES + 1)
+        tombstones = db.execute(select(MessageTombstone.id, MessageTombstone.message_id).
+                                where(MessageTombstone.room_id == entry.room_id, MessageTombstone.id > after_id).
+                                order_by(MessageTombstone.id).limit(SYNC_MAX_TOMBSTONES + 1)).all()
+        if len(messages) <= SYNC_MAX_MESSAGES and len(tombstones) <= SYNC_MAX_TOMBSTONES:
+            result["messages"] = messages
+            result["deleted"] = [row.message_id for row in tombstones]
+            result["tombstone_cursor"] = tombstone_cursor(now, tombstones[-1].id if tombstones else after_id)
+            return result
+
+    # too far behind: the client reloads the room, deletions from here on come with its next sync
+    baseline = db.execute(select(func.max(MessageTombstone.id)).
+                          where(MessageTombstone.room_id == entry.room_id)).scalar() or 0
+    result["reset"] = True
+    result["tombstone_cursor"] = tombstone_cursor(now, baseline)
+    return result
+
+
+@router.post("/sync", response_model=SyncResponse, tags=['message'])
+def sync(payload: SyncRequest, db: Session = Depends(get_read_db), current_user: User = Depends(get_current_user)):
+    """Catch a reconnecting client up on its open rooms.
+
+    For every room the messages after the newest one the client has and the
+    ids deleted since its tombstone cursor, or `reset` when the gap is larger
+    than SYNC_MAX_MESSAGES / SYNC_MAX_TOMBSTONES or older than the tombstone
+    retention.
+    """
+    if len(payload.rooms) > MAX_SYNC_ROOMS:
+        raise HTTPException(400, f"At most {MAX_SYNC_ROOMS} rooms per sync")
+    room_ids = {entry.room_id for entry in payload.rooms}
+    room_servers = dict(db.execute(select(Room.id, Room.server_id).where(Room.id.in_(room_ids))).all())
+    member_of = set(db.execute(select(ServerUser.server_id).where(
+        ServerUser.user_id == current_user.id, ServerUser.server_id.in_(set(room_servers.values())))).scalars())
+    now = datetime.utcnow()
+    rooms = []
+    for entry in payload.rooms:
+        if room_servers.get(entry.room_id) not in member_of:
+            rooms.append({"room_id": entry.room_id, "gone": True})
+        else:
+            rooms.append(sync_room(db, entry, now))
+    return {"rooms": rooms}
 
 @router.delete("/messages/{message_id}", tags=['message'])
-def delete_message(message_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    msg = db.query(Message).filter(Message.id == message_id).first()
+async def delete_message(message_id: str, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    msg = (await db.execute(select(Message).filter(Message.id == message_id))).scalars().first()
+    if not msg and message_writer.is_pending(message_id):
+        # sent moments ago and still queued by the write-behind writer
+        await message_writer.flush()
+        msg = (await db.execute(select(Message).filter(Message.id == message_id))).scalars().first()
     if not msg:
         raise HTTPException(404, "Message not found")
     
-    room = db.query(Room).filter(Room.id == msg.room_id).first()
+    room = (await db.execute(select(Room).filter(Room.id == msg.room_id))).scalars().first()
     if not room:
         raise HTTPException(404, "Room not found")
     
     is_sender = msg.sender == current_user.username
-    is_admin = db.query(ServerUser).filter(
-        ServerUser.user_id == current_user.id,
-        ServerUser.server_id == room.server_id,
-        ServerUser.role == "admin"
-    ).first()
+    is_admin = await get_role_async(db, current_user.id, room.server_id) == "admin"
     
     if not (is_sender or is_admin):
         raise HTTPException(403, "Not authorized to delete message")
     
-    db.delete(msg)
-    db.commit()
+    await db.delete(msg)
+    # reconnecting clients learn about the deletion from /sync
+    db.add(MessageTombstone(message_id=msg.id, room_id=room.id))
+    await db.commit()
+    await manager.broadcast_delete_message(room.id, message_id)
     
     return {
         "detail": "Message deleted by admin" if is_admin and not is_sender else "Message deleted"
@@ -319,15 +566,52 @@ def create_server_user(payload: ServerUserCreate, db: Session = Depends(get_db),
     db.add(su)
     db.commit()
     db.refresh(su)
+    invalidate_membership(payload.user_id, payload.server_id)
     return su
 
 
+@router.post("/server/join/bulk", response_model=ServerUserBulkResponse, tags = ['server user'])
+async def create_server_users_bulk(payload: ServerUserBulkCreate, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    """Add many users to a server in one transaction, users that are already members are skipped"""
+    user_ids = list(dict.fromkeys(payload.user_ids))
+    if not user_ids:
+        raise HTTPException(400, "No users given")
+    if len(user_ids) > MAX_BULK_ITEMS:
+        raise HTTPException(400, f"At most {MAX_BULK_ITEMS} users per request")
+    if not (await db.execute(select(Server.id).filter(Server.id == payload.server_id))).first():
+        raise HTTPException(404, "Server not found")
+    if await get_role_async(db, current_user.id, payload.server_id) != "admin":
+        raise HTTPException(403, "Only admin can add users in bulk")
+
+    # which of the users exist and which are already members, in one query
+    found = (await db.execute(
+        select(User.id, ServerUser.id.label("membership_id"))
+        .outerjoin(ServerUser, (ServerUser.user_id == User.id) & (ServerUser.server_id == payload.server_id))
+        .filter(User.id.in_(user_ids))
+    )).all()
+    existing = {row.id: row.membership_id for row in found}
+    missing = [user_id for user_id in user_ids if user_id not in existing]
+    if missing:
+        raise HTTPException(404, f"Users not found: {', '.join(missing)}")
+
+    already_members = [user_id for user_id in user_ids if existing[user_id] is not None]
+    rows = [
+        {"id": str(uuid.uuid1()), "user_id": user_id, "server_id": payload.server_id, "role": payload.role}
+        for user_id in user_ids if existing[user_id] is None
+    ]
+    if rows:
+        await db.execute(insert(ServerUser), rows)
+        await db.commit()
+        invalidate_membership(server_id=payload.server_id)
+    return {"added": rows, "already_members": already_members}
+
+
 @router.get('/server_user/{server_id}' , response_model=list[UsersList] ,tags= ['server user']) 
-def get_users_list(server_id ,db:Session = Depends(get_db)  , current_user : User = Depends(get_current_user)) :
+def get_users_list(server_id ,db:Session = Depends(get_read_db)  , current_user : User = Depends(get_current_user)) :
     server = db.query(Server).filter(Server.id == server_id).first()
     if not server :
         raise HTTPException(404, "Server not found")
-    if not db.query(ServerUser).filter(ServerUser.server_id == server_id , ServerUser.user_id == current_user.id).first() :
+    if get_role(db, current_user.id, server_id) is None :
         raise HTTPException(403, "Not a member of server")
     
     userList = db.query(User.id , User.username , ServerUser.role).join(ServerUser , ServerUser.user_id == User.id).filter(ServerUser.server_id == server_id).all()
@@ -341,130 +625,126 @@ def delete_server_user(su_id: str, db: Session = Depends(get_db), current_user:
     server = db.query(Server).filter(Server.id == su.server_id).first()
     if server.admin_id != current_user.id and current_user.id != su.user_id:
         raise HTTPException(403, "Only admin or the user themselves can remove membership")
+    user_id, server_id = su.user_id, su.server_id
     db.delete(su)
     db.commit()
+    invalidate_membership(user_id, server_id)
     return {"detail": "Server user removed"}
 
 # ------------------------
 # WEBSOCKET CHAT
 # ------------------------
-class RateLimiter:
-    def __init__(self):
-        self.user_messages = defaultdict(list)
-    
-    def can_send_message(self, username: str, max_messages: int = 10, seconds: int = 10):
-        
-        now = datetime.now() 
-        cutoff_time = now - timedelta(seconds=seconds) 
-        
-        self.user_messages[username] = [
-            msg_time for msg_time in self.user_messages[username] 
-            if msg_time > cutoff_time
-        ]
-        
-        if len(self.user_messages[username]) >= max_messages:
-            return False  
-        
-        self.user_messages[username].append(now) 
-        return True  
-
-rate_limiter = RateLimiter()
+async def authenticate_socket(websocket: WebSocket, token: str, db: AsyncSession):
+    """Resolve the user behind a websocket token, closing the socket when it is not valid"""
+    try:
+        payload = decode_token(token)
+        user_id = payload.get("sub")
 
+        if user_id is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid token: user not found")
+            return None
+    except JWTError as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=f"Invalid token: {str(e)}")
+        return None
 
-@router.websocket("/ws/{room_id}")
-async def chat_socket(websocket: WebSocket, room_id: str, token: str = Query(...), db: Session = Depends(get_db)):
+    user = await load_user_async(db, user_id)
+    if not user:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="User not found")
+        return None
+    return user
 
 
+def catch_up(websocket: WebSocket, room_id: str, since: str | int):
+    """Reconnect catch-up from the recent message buffer, duplicates are
+    possible around the connect and clients dedupe by seq"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("username")
+        missed = recent_messages.since(room_id, decode_cursor(since))
+    except HTTPException:
+        missed = None
+    if missed is None:
+        manager.send_personal(websocket, {"type": "resync", "room_id": room_id})
+    else:
+        for message in missed:
+            manager.send_personal(websocket, message_payload(message))
 
-        if username is None:
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid token: username not found")
-            return
-    except (JWTError, jwt.InvalidTokenError) as e:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=f"Invalid token: {str(e)}")
-        return
 
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="User not found")
-        return
+@router.websocket("/ws/{room_id}")
+async def chat_socket(websocket: WebSocket, room_id: str, token: str = Query(...), since: str | None = Query(None)):
+
+    # short lived sessions so no connection is held for the lifetime of the socket
+    async with asyncSessionLocal() as db:
+        user = await authenticate_socket(websocket, token, db)
+        if user is None:
+            return
+        username = user.username
 
-    room_obj = db.query(Room).filter(Room.id == room_id).first()
-    if not room_obj:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Room not found")
-        return
+        room_obj = (await db.execute(select(Room).filter(Room.id == room_id))).scalars().first()
+        if not room_obj:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Room not found")
+            return
 
-    membership = db.query(ServerUser).filter(
-        ServerUser.user_id == user.id,
-        ServerUser.server_id == room_obj.server_id
-    ).first()
-    
-    if not membership:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Not a member of this server")
-        return
+        if await get_role_async(db, user.id, room_obj.server_id) is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Not a member of this server")
+            return
 
     await websocket.accept()
+    # the sender's next history reads go to the primary, see get_read_db
+    writer_key = token_digest(token)
     
     await manager.connect(websocket, room_id, username)
+    if since:
+        catch_up(websocket, room_id, since)
     try:
         while True:
             msg_text = await websocket.receive_text()
+            manager.touch(websocket)
+            if is_heartbeat(msg_text):
+                continue
             
-            if not rate_limiter.can_send_message(username):
-                await websocket.send_json({
+            if not await rate_limiter.hit("ws_message", user.id):
+                manager.send_personal(websocket, {
                     "error": "You're sending messages too fast. Please slow down.",
                     "type": "rate_limit"
                 })
                 continue  
             
-            new_msg = Message(room_id=room_obj.id, sender=username, content=msg_text)
-            db.add(new_msg)
-            db.commit()
-            db.refresh(new_msg)
-            payload = {"sender": username, "content": msg_text, "created_at": str(new_msg.timestamp)}
-            await manager.broadcast(room_id, payload)
+            # persisted in the background, the broadcast does not wait for the insert
+            try:
+                new_msg = await message_writer.submit(room_obj.id, username, msg_text)
+            except LookupError:
+                manager.send_personal(websocket, {"type": "error", "error": "Room not found", "room_id": room_id})
+                continue
+            except SequenceUnavailable:
+                manager.send_personal(websocket, {"type": "error", "error": "Message could not be sent, try again",
+                                                  "room_id": room_id})
+                continue
+            mark_write(writer_key)
+            await manager.broadcast(room_id, message_payload(new_msg))
             
     except WebSocketDisconnect:
         manager.disconnect(websocket, room_id)
-    except Exception as e:
-        print(f"Error in chat_socket: {e}")
+    except Exception:
+        logger.exception("chat socket failed", extra={"room_id": room_id})
         manager.disconnect(websocket, room_id)
 
 @router.websocket("/ws/server/{server_id}")
-async def server_socket(websocket: WebSocket, server_id: str, token: str = Query(...), db: Session = Depends(get_db)):
+async def server_socket(websocket: WebSocket, server_id: str, token: str = Query(...)):
     """WebSocket endpoint for server-level events (room creation, etc.)"""
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("username")
-
-        if username is None:
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid token: username not found")
+    async with asyncSessionLocal() as db:
+        user = await authenticate_socket(websocket, token, db)
+        if user is None:
             return
-    except (JWTError, jwt.InvalidTokenError) as e:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=f"Invalid token: {str(e)}")
-        return
-
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="User not found")
-        return
+        username = user.username
 
-    # Verify server exists and user is a member
-    server = db.query(Server).filter(Server.id == server_id).first()
-    if not server:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Server not found")
-        return
+        # Verify server exists and user is a member
+        server = (await db.execute(select(Server.id).filter(Server.id == server_id))).first()
+        if not server:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Server not found")
+            return
 
-    membership = db.query(ServerUser).filter(
-        ServerUser.user_id == user.id,
-        ServerUser.server_id == server_id
-    ).first()
-    
-    if not membership:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Not a member of this server")
-        return
+        if await get_role_async(db, user.id, server_id) is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Not a member of this server")
+            return
 
     await websocket.accept()
     await manager.connect_to_server(websocket, server_id, username)
@@ -473,11 +753,126 @@ async def server_socket(websocket: WebSocket, server_id: str, token: str = Query
         while True:
             # Keep connection alive and handle any incoming messages if needed
             data = await websocket.receive_text()
+            manager.touch(websocket)
+            if is_heartbeat(data):
+                continue
             # Echo back or handle client messages if needed
-            await websocket.send_json({"type": "pong", "message": "Connection alive"})
+            manager.send_personal(websocket, {"type": "pong", "message": "Connection alive"})
     except WebSocketDisconnect:
         manager.disconnect_from_server(websocket, server_id)
-    except Exception as e:
-        print(f"Error in server_socket: {e}")
+    except Exception:
+        logger.exception("server socket failed", extra={"server_id": server_id})
         manager.disconnect_from_server(websocket, server_id)
 
+
+# ------------------------
+# MULTIPLEXED WEBSOCKET
+# ------------------------
+# rooms + servers one multiplexed socket may subscribe to
+MAX_SUBSCRIPTIONS = 500
+
+
+async def subscribe(websocket: WebSocket, user: User, frame: dict) -> dict:
+    """Check membership for a subscribe frame and register the socket, returns the reply"""
+    room_id, server_id = frame.get("room_id"), frame.get("server_id")
+    if bool(room_id) == bool(server_id):
+        return {"type": "error", "error": "Subscribe to either a room_id or a server_id"}
+    if manager.subscriptions(websocket) >= MAX_SUBSCRIPTIONS:
+        return {"type": "error", "error": "Too many subscriptions"}
+    async with asyncSessionLocal() as db:
+        if room_id:
+            server_id = (await db.execute(select(Room.server_id).filter(Room.id == room_id))).scalar()
+            if server_id is None:
+                return {"type": "error", "error": "Room not found", "room_id": room_id}
+        if await get_role_async(db, user.id, server_id) is None:
+            return {"type": "error", "error": "Not a member of this server", "server_id": server_id}
+    if room_id:
+        await manager.connect(websocket, room_id, user.username)
+        return {"type": "subscribed", "room_id": room_id}
+    await manager.connect_to_server(websocket, server_id, user.username)
+    return {"type": "subscribed", "server_id": server_id}
+
+
+@router.websocket("/ws")
+async def multiplexed_socket(websocket: WebSocket, token: str = Query(...)):
+    """One socket per client, rooms and servers are joined with JSON frames:
+
+        {"action": "subscribe", "room_id": "...", "since": <seq of the last message seen>}
+        {"action": "subscribe", "server_id": "..."}
+        {"action": "unsubscribe", "room_id": "..."} / {"action": "unsubscribe", "server_id": "..."}
+        {"action": "message", "room_id": "...", "content": "..."}
+        {"action": "ping"}
+
+    Server heartbeats arrive as {"type": "ping"} and are answered with {"type": "pong"}.
+    Broadcasts carry their room_id (or server_id) so the client can route them.
+    """
+    async with asyncSessionLocal() as db:
+        user = await authenticate_socket(websocket, token, db)
+        if user is None:
+            return
+
+    await websocket.accept()
+    writer_key = token_digest(token)
+    client = manager.attach(websocket, user.username)
+    try:
+        while True:
+            text = await websocket.receive_text()
+            manager.touch(websocket)
+            try:
+                frame = json.loads(text)
+                action = frame.get("action") or frame.get("type")
+            except (ValueError, AttributeError):
+                manager.send_personal(websocket, {"type": "error", "error": "Frames must be JSON objects"})
+                continue
+
+            if action == "message":
+                room_id, content = frame.get("room_id"), frame.get("content")
+                if room_id not in client.rooms:
+                    manager.send_personal(websocket, {"type": "error", "error": "Not subscribed to this room",
+                                                      "room_id": room_id})
+                elif not content or not isinstance(content, str):
+                    manager.send_personal(websocket, {"type": "error", "error": "Message content invalid",
+                                                      "room_id": room_id})
+                elif not await rate_limiter.hit("ws_message", user.id):
+                    manager.send_personal(websocket, {
+                        "error": "You're sending messages too fast. Please slow down.",
+                        "type": "rate_limit",
+                        "room_id": room_id,
+                    })
+                else:
+                    try:
+                        new_msg = await message_writer.submit(room_id, user.username, content)
+                    except LookupError:
+                        manager.send_personal(websocket, {"type": "error", "error": "Room not found",
+                                                          "room_id": room_id})
+                        continue
+                    except SequenceUnavailable:
+                        manager.send_personal(websocket, {"type": "error", "error": "Message could not be sent, try again",
+                                                          "room_id": room_id})
+                        continue
+                    mark_write(writer_key)
+                    await manager.broadcast(room_id, message_payload(new_msg))
+            elif action == "subscribe":
+                reply = await subscribe(websocket, user, frame)
+                manager.send_personal(websocket, reply)
+                if reply["type"] == "subscribed" and frame.get("room_id") and frame.get("since"):
+                    catch_up(websocket, frame["room_id"], frame["since"])
+            elif action == "unsubscribe":
+                if frame.get("room_id"):
+                    manager.disconnect(websocket, frame["room_id"])
+                    manager.send_personal(websocket, {"type": "unsubscribed", "room_id": frame["room_id"]})
+                elif frame.get("server_id"):
+                    manager.disconnect_from_server(websocket, frame["server_id"])
+                    manager.send_personal(websocket, {"type": "unsubscribed", "server_id": frame["server_id"]})
+            elif action == "ping":
+                manager.send_personal(websocket, {"type": "pong"})
+            elif action == "pong":
+                # heartbeat answer, touch() already recorded it
+                continue
+            else:
+                manager.send_personal(websocket, {"type": "error", "error": f"Unknown action: {action}"})
+    except WebSocketDisconnect:
+        manager.detach(websocket)
+    except Exception:
+        logger.exception("multiplexed socket failed")
+        manager.detach(websocket)
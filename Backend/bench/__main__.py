@@ -0,0 +1,49 @@
+"""PingSpace benchmarks, run from the Backend directory:
+
+    python -m bench load --sockets 10000 --rooms 100 --rate 500 --json report.json
+    python -m bench fanout
+    python -m bench churn
+    python -m bench auth
+    python -m bench query-plans
+    python -m bench query-counts
+    python -m bench db-concurrency
+    python -m bench replica-check
+    python -m bench archive-check
+    python -m bench sync-check
+    python -m bench broker-check
+    python -m bench writer-check
+    python -m bench search --messages 10000000 --db /tmp/search-corpus.db
+"""
+import importlib
+import sys
+
+COMMANDS = {
+    "load": "bench.loadtest",
+    "fanout": "bench.fanout_bench",
+    "churn": "bench.churn_bench",
+    "auth": "bench.auth_bench",
+    "query-plans": "bench.query_plans",
+    "query-counts": "bench.query_counts",
+    "db-concurrency": "bench.db_concurrency",
+    "replica-check": "bench.replica_check",
+    "archive-check": "bench.archive_check",
+    "sync-check": "bench.sync_check",
+    "broker-check": "bench.broker_check",
+    "writer-check": "bench.writer_check",
+    "resp-standin": "bench.resp_standin",
+    "search": "bench.search_bench",
+}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(__doc__)
+        print("commands: " + ", ".join(COMMANDS))
+        sys.exit(2)
+    command = sys.argv.pop(1)
+    sys.argv[0] = f"python -m bench {command}"
+    importlib.import_module(COMMANDS[command]).main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Message archive check on a temp database and archive directory.
+
+Fills a room with four months of history, archives everything older than
+ARCHIVE_AFTER_DAYS and verifies that paging through GET /messages backwards
+and forwards still returns every message exactly once, in order, across
+the boundary between the hot table and the archive. It also simulates a
+crash between writing a batch and deleting it. Run from the Backend
+directory:
+
+    python -m bench.archive_check
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from bench.checks import Expectations, run, signup, temp_app_env
+
+MESSAGES = 1200
+SPACING = timedelta(hours=2, minutes=17)
+MAX_AGE_DAYS = 30
+
+
+def check():
+    temp_app_env("pingspace-archive-", ARCHIVE_AFTER_DAYS=MAX_AGE_DAYS)
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, insert, select, update
+
+    import main
+    from Database.archive import INDEX_FILE, message_archive, read_index, read_partition, _encode, _write_durably
+    from Database.db import engine
+    from models.message import Message
+    from models.room import Room
+
+    expect = Expectations()
+
+    def walk(client, headers, room_id, direction, cursor=None, limit=37):
+        """Every page of a room's history following next_cursor, returns the ids in walking order"""
+        ids = []
+        while True:
+            params = {"limit": limit}
+            if cursor:
+                params[direction] = cursor
+            body = client.get(f"/messages/{room_id}", params=params, headers=headers).json()
+            page = [message["id"] for message in body["messages"]]
+            ids += page if direction == "before" else page[::-1]
+            cursor = body["next_cursor"]
+            if cursor is None:
+                return ids
+
+    def hot_rows(room_id):
+        with engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(Message).where(Message.room_id == room_id)).scalar()
+
+    with TestClient(main.app) as client:
+        _, headers = signup(client, "alice")
+        server = client.post("/servers", json={"name": "archive"}, headers=headers).json()
+        room = client.post("/rooms", json={"name": "old", "server_id": server["id"]}, headers=headers).json()
+
+        now = datetime.utcnow()
+        rows = [{"id": str(uuid.uuid1()), "room_id": room["id"], "sender": "alice",
+                 "content": f"message {i} archivable" if i == 0 else f"message {i}",
+                 "timestamp": now - SPACING * (MESSAGES - i), "seq": i + 1} for i in range(MESSAGES)]
+        with engine.begin() as conn:
+            conn.execute(insert(Message), rows)
+            conn.execute(update(Room).where(Room.id == room["id"]).values(last_seq=MESSAGES))
+        oldest_first = [row["id"] for row in rows]
+        cutoff = now - timedelta(days=MAX_AGE_DAYS)
+        expected_archived = sum(row["timestamp"] < cutoff for row in rows)
+
+        moved = message_archive.archive_once()
+        expect("rows moved", moved == expected_archived, f"{moved} moved, {expected_archived} older than the cutoff")
+        expect("hot table trimmed", hot_rows(room["id"]) == MESSAGES - moved, f"{hot_rows(room['id'])} rows left")
+        index = read_index(os.path.join(message_archive.room_dir(room["id"]), INDEX_FILE))
+        partitions = index["partitions"]
+        closed = [month for month in partitions if partitions[month]["compacted"]]
+        expect("closed months compacted", len(closed) >= len(partitions) - 1,
+               f"{len(closed)} of {len(partitions)} months compacted")
+        expect("archive row count", sum(info["rows"] for info in partitions.values()) == moved,
+               f"{sum(info['rows'] for info in partitions.values())} rows indexed")
+
+        backwards = walk(client, headers, room["id"], "before")
+        expect("paging back across the archive", backwards == oldest_first[::-1],
+               f"{len(backwards)} messages, {len(set(backwards))} distinct")
+        first = client.get(f"/messages/{room['id']}", headers=headers).json()["messages"]
+        expect("first page without a cursor", first[0]["id"] == oldest_first[-1], "newest message first")
+        origin = "0"
+        forwards = walk(client, headers, room["id"], "after", cursor=origin)
+        expect("paging forward out of the archive", forwards == oldest_first,
+               f"{len(forwards)} messages, {len(set(forwards))} distinct")
+
+        # a crash after writing a batch but before deleting it leaves the newest archived rows in both places
+        newest_archived = rows[expected_archived - 25:expected_archived]
+        with engine.begin() as conn:
+            conn.execute(insert(Message), newest_archived)
+        last_month = max(partitions)
+        _write_durably(message_archive.partition_path(room["id"], last_month),
+                       _encode([row for row in newest_archived if row["timestamp"].strftime("%Y-%m") == last_month]),
+                       "ab")
+        backwards = walk(client, headers, room["id"], "before", limit=50)
+        forwards = walk(client, headers, room["id"], "after", cursor=origin, limit=50)
+        expect("no duplicates after a crash", backwards == oldest_first[::-1] and forwards == oldest_first,
+               f"{len(backwards)} back, {len(forwards)} forward")
+        message_archive.archive_once()
+        rows_in_month = len(read_partition(message_archive.partition_path(room["id"], last_month)))
+        expect("re-archived rows deduplicated", hot_rows(room["id"]) == MESSAGES - expected_archived,
+               f"{hot_rows(room['id'])} hot rows, {rows_in_month} distinct rows in {last_month}")
+
+        found = client.get("/search", params={"q": "archivable"}, headers=headers).json()["results"]
+        expect("archived messages leave search", found == [], f"{len(found)} results")
+        stats = client.get("/stats").json()["archive"]
+        expect("stats", stats["enabled"] and stats["max_age_days"] == MAX_AGE_DAYS, str(stats))
+
+        client.delete(f"/rooms/{room['id']}", headers=headers)
+        expect("room deletion drops its archive", not os.path.exists(message_archive.room_dir(room["id"])),
+               message_archive.room_dir(room["id"]))
+    return expect.failures
+
+
+def main():
+    run(check, "archive checks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark: get_current_user overhead per request, uncached vs cached.
+
+Uses an in-memory SQLite database with a single user. Run from the Backend
+directory:
+
+    python -m bench.auth_bench --requests 5000
+"""
+import argparse
+import json
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import Base, User
+from Routers.auth import create_access_token, get_current_user, token_cache, user_cache
+
+
+def measure(session_factory, token, requests, cached):
+    if cached:
+        # warm the caches once, the way the first request of a session would
+        with session_factory() as db:
+            get_current_user(token, db)
+    start = time.perf_counter()
+    for _ in range(requests):
+        if not cached:
+            token_cache.clear()
+            user_cache.clear()
+        # a fresh session per request, like the get_db dependency
+        with session_factory() as db:
+            get_current_user(token, db)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+    with session_factory() as db:
+        user = User(username="bench", password="x")
+        db.add(user)
+        db.commit()
+        token = create_access_token({"sub": user.id, "username": user.username})
+
+    before = measure(session_factory, token, args.requests, cached=False)
+    after = measure(session_factory, token, args.requests, cached=True)
+    print(json.dumps({
+        "requests": args.requests,
+        "uncached_us": round(before * 1e6, 1),
+        "cached_us": round(after * 1e6, 1),
+        "speedup": round(before / after, 2),
+    }))
+
+
+if __name__ == "__main__":
+    main()
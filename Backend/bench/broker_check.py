@@ -0,0 +1,156 @@
+"""Redis broker and shared rate limiter check against the in-process RESP stand-in.
+
+Two RedisBroker instances stand in for two workers: a frame published by
+one reaches the other, and after the stand-in drops every connection (a
+restart) the subscriber reconnects and delivery resumes. Two
+SharedRateLimiter instances hit the same key concurrently from a cold start
+and must share one limit without hanging. Two RedisSequenceAllocator
+instances hand out unique seqs continuing from room.last_seq, and continue
+from the flushed seqs after the stand-in loses its counters. Run from the
+Backend directory:
+
+    python -m bench.broker_check
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from bench.checks import DATABASE_FILE, Expectations, run
+from bench.resp_standin import RespStandIn
+from Database.sequence import RedisSequenceAllocator
+from models import Base, Room
+from utils.rate_limit import SharedRateLimiter, limit_for
+from ws import broker as broker_module
+from ws.broker import RedisBroker
+
+# the stand-in is local, anything slower than this is a hang
+DEADLINE_SECONDS = 5
+
+
+async def wait_until(condition, timeout: float = DEADLINE_SECONDS) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.02)
+    return True
+
+
+async def check_brokers(expect, standin, url, restart):
+    received = {"a": [], "b": []}
+    brokers = {}
+    for name in received:
+        brokers[name] = RedisBroker(url)
+        brokers[name].attach(lambda channel, frame, name=name: received[name].append((channel, frame)))
+        await brokers[name].start()
+
+    await brokers["a"].publish("room:1", "hello")
+    delivered = await wait_until(lambda: ("room:1", "hello") in received["b"])
+    expect("delivery between workers", delivered and received["a"] == [("room:1", "hello")], str(received))
+
+    await restart()
+    resubscribed = await wait_until(lambda: len(standin.subscribers) == 2)
+    expect("resubscribe after a restart", resubscribed, f"{len(standin.subscribers)} subscribers")
+    # the first publish may still go out on the dropped connection and only reach the local worker
+    attempt = 0
+    while attempt < 5 and not any(frame.startswith("after-restart") for _, frame in received["b"]):
+        attempt += 1
+        await brokers["a"].publish("room:1", f"after-restart-{attempt}")
+        await wait_until(lambda: any(frame.startswith("after-restart") for _, frame in received["b"]), 0.5)
+    resumed = [frame for _, frame in received["b"] if frame.startswith("after-restart")]
+    expect("delivery after a restart", bool(resumed), f"{attempt} publishes, received {resumed}")
+
+    for instance in brokers.values():
+        await instance.close()
+
+
+async def check_limiters(expect, url):
+    capacity, _ = limit_for("post_message", "broker-check")
+    limiters = [SharedRateLimiter(url), SharedRateLimiter(url)]
+    # every hit starts before either limiter has a connection
+    hits = [limiters[i % 2].hit("post_message", "broker-check") for i in range(capacity * 3)]
+    try:
+        results = await asyncio.wait_for(asyncio.gather(*hits), DEADLINE_SECONDS)
+    except asyncio.TimeoutError:
+        expect("cold start hits return", False, f"no answer within {DEADLINE_SECONDS}s")
+        return
+    expect("cold start hits return", True, f"{len(results)} answered")
+    expect("one limit shared by both workers", sum(results) == capacity,
+           f"{sum(results)} allowed of {len(results)}, capacity {capacity}")
+    for limiter in limiters:
+        await limiter.redis.close()
+
+
+async def check_sequences(expect, standin, url):
+    path = os.path.join(tempfile.mkdtemp(prefix="pingspace-broker-"), DATABASE_FILE)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Room), [{"id": "seq-room", "name": "seq", "description": "", "last_seq": 40}])
+    workers = [RedisSequenceAllocator(engine, url), RedisSequenceAllocator(engine, url)]
+
+    seqs = await asyncio.gather(*[workers[i % 2].next("seq-room") for i in range(20)])
+    expect("seqs unique across workers", sorted(seqs) == list(range(41, 61)), f"{min(seqs)}..{max(seqs)}")
+
+    # the writer raises room.last_seq as it flushes, then the server loses its data
+    async with engine.begin() as conn:
+        await workers[0].record(conn, [{"room_id": "seq-room", "seq": 60}])
+    standin.counters.clear()
+    after = [await worker.next("seq-room") for worker in workers]
+    async with engine.connect() as conn:
+        last_seq = (await conn.execute(select(Room.last_seq).where(Room.id == "seq-room"))).scalar()
+    expect("counter continues from the flushed seqs", after == [61, 62] and last_seq == 60,
+           f"next {after}, room.last_seq {last_seq}")
+
+    try:
+        await workers[0].next("no-such-room")
+        missing = "no error"
+    except LookupError:
+        missing = "LookupError"
+    expect("missing room", missing == "LookupError", missing)
+    for worker in workers:
+        await worker.redis.close()
+    await engine.dispose()
+
+
+async def check_async():
+    expect = Expectations()
+    broker_module.RECONNECT_DELAY_SECONDS = 0.1
+    standin = RespStandIn()
+    server = await asyncio.start_server(standin.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    url = f"redis://127.0.0.1:{port}"
+
+    async def restart():
+        nonlocal server
+        server.close()
+        standin.drop_connections()
+        await server.wait_closed()
+        await asyncio.sleep(0.3)
+        server = await asyncio.start_server(standin.handle, "127.0.0.1", port)
+
+    await check_brokers(expect, standin, url, restart)
+    await check_limiters(expect, url)
+    await check_sequences(expect, standin, url)
+    server.close()
+    standin.drop_connections()
+    await server.wait_closed()
+    # let the stand-in's handlers see their connections close before the loop ends
+    await wait_until(lambda: not standin.connections)
+    return expect.failures
+
+
+def check():
+    return asyncio.run(check_async())
+
+
+def main():
+    run(check, "broker checks")
+
+
+if __name__ == "__main__":
+    main()
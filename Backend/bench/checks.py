@@ -0,0 +1,52 @@
+"""Shared pieces of the check scripts that boot the app on a temp database.
+
+Call temp_app_env before importing main, the settings are read from the
+environment at import time.
+"""
+import os
+import sys
+import tempfile
+
+DATABASE_FILE = "chat.db"
+
+
+def temp_app_env(prefix: str, **env) -> str:
+    """Point the app at a fresh temp directory and return it.
+
+    The database is DATABASE_FILE and the message archive archive/ inside
+    it, `env` sets further variables.
+    """
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    # read by Database/config.py and Database/archive.py when the app is imported
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, DATABASE_FILE)}"
+    os.environ["ARCHIVE_DIR"] = os.path.join(workdir, "archive")
+    os.environ.update({name: str(value) for name, value in env.items()})
+    os.environ.setdefault("LOG_LEVELS", "httpx=WARNING")
+    return workdir
+
+
+class Expectations:
+    """Prints one ok/FAIL line per expectation and collects the names that failed"""
+
+    def __init__(self):
+        self.failures = []
+
+    def __call__(self, name: str, condition: bool, detail: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {name}: {detail}")
+        if not condition:
+            self.failures.append(name)
+
+
+def signup(client, username: str, password: str = "pw"):
+    """Create a user and log in, returns the user id and the auth headers"""
+    user = client.post("/signup", json={"username": username, "password": password}).json()
+    token = client.post("/login", data={"username": username, "password": password}).json()["access_token"]
+    return user["id"], {"Authorization": f"Bearer {token}"}
+
+
+def run(check, what: str):
+    """Run a check and exit non-zero when anything failed"""
+    failures = check()
+    if failures:
+        print(f"{len(failures)} {what} failed", file=sys.stderr)
+        sys.exit(1)
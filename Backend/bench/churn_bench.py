@@ -0,0 +1,67 @@
+"""Benchmark: connection churn through the ConnectionManager registry.
+
+Opens and closes N fake sockets spread over a number of rooms, then checks
+that the registry is empty again. Run from the Backend directory:
+
+    python -m bench.churn_bench --sockets 100000 --rooms 1000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from ws.broker import InMemoryBroker
+from ws.connection_manager import ConnectionManager
+
+
+class FakeSocket:
+    async def send_text(self, data):
+        pass
+
+    async def close(self):
+        pass
+
+
+async def run(sockets, rooms, batch):
+    manager = ConnectionManager(broker=InMemoryBroker())
+    room_ids = [f"room-{i}" for i in range(rooms)]
+    connect_time = disconnect_time = 0.0
+    peak = None
+    for offset in range(0, sockets, batch):
+        opened = [(FakeSocket(), random.choice(room_ids)) for _ in range(min(batch, sockets - offset))]
+        start = time.perf_counter()
+        for i, (socket, room_id) in enumerate(opened):
+            await manager.connect(socket, room_id, f"user-{(offset + i) % 5000}")
+        connect_time += time.perf_counter() - start
+        if peak is None:
+            peak = manager.memory_report()
+        # close in a different order than they were opened
+        random.shuffle(opened)
+        start = time.perf_counter()
+        for socket, room_id in opened:
+            manager.disconnect(socket, room_id)
+        disconnect_time += time.perf_counter() - start
+        # let the cancelled writer tasks finish
+        await asyncio.sleep(0)
+    return {
+        "sockets": sockets,
+        "rooms": rooms,
+        "connect_us": round(connect_time / sockets * 1e6, 2),
+        "disconnect_us": round(disconnect_time / sockets * 1e6, 2),
+        "peak": peak,
+        "after": manager.memory_report(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sockets", type=int, default=100000)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=10000, help="sockets open at the same time")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.sockets, args.rooms, args.batch)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Benchmark: get_history reads under concurrent chat writes, before/after the SQLite tuning.
+
+"before" is the old engine (default rollback journal, synchronous=FULL, no
+busy timeout), "after" is the engine Database/db.py builds now (WAL,
+synchronous=NORMAL, mmap, page cache, busy_timeout and a sized pool). Each
+mode gets a fresh database file with the same seeded history. Reader threads
+run the history page query while writer threads insert message batches the
+way the write-behind writer does. Run from the Backend directory:
+
+    python -m bench.db_concurrency --readers 4 --writers 2 --duration 5
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from Database.config import apply_sqlite_pragmas, engine_options
+from models import Base, Message
+
+PAGE_SIZE = 50
+
+
+def build_engine(mode: str, path: str):
+    url = f"sqlite:///{path}"
+    if mode == "before":
+        return create_engine(url, connect_args={"check_same_thread": False})
+    engine = create_engine(url, **engine_options(url))
+    apply_sqlite_pragmas(engine)
+    return engine
+
+
+# seqs unique over every room are also unique within each
+SEQS = itertools.count(1)
+
+
+def message_rows(room_ids, count, start):
+    return [
+        {"id": str(uuid.uuid1()), "room_id": random.choice(room_ids), "sender": "bench",
+         "content": "x" * 64, "timestamp": start + timedelta(microseconds=i), "seq": next(SEQS)}
+        for i in range(count)
+    ]
+
+
+def run_mode(mode: str, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="pingspace-dbbench-")
+    engine = build_engine(mode, os.path.join(workdir, "chat.db"))
+    Base.metadata.create_all(bind=engine)
+    room_ids = [str(uuid.uuid1()) for _ in range(args.rooms)]
+    with engine.begin() as conn:
+        conn.execute(insert(Message), message_rows(room_ids, args.seed, datetime(2026, 1, 1)))
+
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+    stop = threading.Event()
+    latencies = []
+    written = [0]
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+    cursor = 2 ** 62
+
+    def reader():
+        local = []
+        while not stop.is_set():
+            room_id = random.choice(room_ids)
+            start = time.perf_counter()
+            try:
+                # the `before` page of get_history
+                with session_factory() as db:
+                    db.query(Message).filter(Message.room_id == room_id, Message.seq < cursor).\
+                        order_by(Message.seq.desc()).limit(PAGE_SIZE + 1).all()
+            except OperationalError:
+                with lock:
+                    errors["read"] += 1
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    def writer():
+        while not stop.is_set():
+            rows = message_rows(room_ids, args.batch, datetime.utcnow())
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(Message), rows)
+            except OperationalError:
+                with lock:
+                    errors["write"] += 1
+                continue
+            with lock:
+                written[0] += len(rows)
+            time.sleep(args.interval_ms / 1000)
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+
+    latencies.sort()
+    return {
+        "reads_per_sec": round(len(latencies) / elapsed, 1),
+        "read_p50_ms": round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+        "read_p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3) if latencies else None,
+        "read_mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else None,
+        "rows_written_per_sec": round(written[0] / elapsed, 1),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=4, help="threads running get_history pages")
+    parser.add_argument("--writers", type=int, default=2, help="threads inserting message batches")
+    parser.add_argument("--batch", type=int, default=20, help="rows per write transaction")
+    parser.add_argument("--interval-ms", type=float, default=5, help="pause between a writer's batches")
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=50000, help="messages in the database before the run")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--modes", default="before,after")
+    parser.add_argument("--json", default=None, help="write the report to this file")
+    args = parser.parse_args()
+
+    report = {mode: run_mode(mode, args) for mode in args.modes.split(",")}
+    if "before" in report and "after" in report and report["before"]["reads_per_sec"]:
+        report["read_speedup"] = round(report["after"]["reads_per_sec"] / report["before"]["reads_per_sec"], 2)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
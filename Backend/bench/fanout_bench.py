@@ -0,0 +1,84 @@
+"""Micro-benchmark: per-recipient send_json vs encode-once fan-out.
+
+Run from the Backend directory:
+
+    python -m bench.fanout_bench --sizes 10 1000 10000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from ws.serializer import encode, orjson
+
+
+class FakeSocket:
+    """Stands in for a starlette WebSocket, only pays for encoding"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_json(self, data):
+        # same encoding starlette's WebSocket.send_json does
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def send_text(self, data):
+        self.sent += len(data)
+
+
+SAMPLE = {
+    "sender": "alice",
+    "content": "hello everyone, this is a fairly ordinary chat line " * 2,
+    "created_at": "2026-01-01 12:00:00.000000",
+    "id": "0424cce9-cc07-11f0-afe3-a02942707ff5",
+}
+
+
+async def per_recipient(sockets, message):
+    for socket in sockets:
+        await socket.send_json(message)
+
+
+async def encode_once(sockets, message):
+    frame = encode(message)
+    for socket in sockets:
+        await socket.send_text(frame)
+
+
+async def measure(fn, sockets, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await fn(sockets, SAMPLE)
+    return (time.perf_counter() - start) / rounds
+
+
+async def run(sizes, rounds):
+    results = []
+    for size in sizes:
+        sockets = [FakeSocket() for _ in range(size)]
+        # fewer rounds for big rooms so every size takes roughly the same time
+        n = max(1, rounds * 10 // max(size, 10))
+        before = await measure(per_recipient, sockets, n)
+        after = await measure(encode_once, sockets, n)
+        results.append({
+            "sockets": size,
+            "per_recipient_ms": round(before * 1000, 3),
+            "encode_once_ms": round(after * 1000, 3),
+            "speedup": round(before / after, 2) if after else None,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}")
+    for row in asyncio.run(run(args.sizes, args.rounds)):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""WebSocket load test: boots PingSpace in-process and measures fan-out.
+
+The app runs under uvicorn on its own thread and event loop against a fresh
+SQLite database in a temp directory. Users, one server and its rooms are
+inserted directly, then N sockets connect to /ws/{room_id} and a subset of
+them send at a fixed total rate. Every delivered broadcast is timed from
+send to receive.
+
+    python -m bench load --sockets 1000 --rooms 10 --rate 200 --duration 10 --json before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def raise_fd_limit(sockets: int):
+    # every socket costs a descriptor on both the client and the server side
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, max(soft, sockets * 2 + 256))
+    if wanted > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+    return samples[index]
+
+
+def provision(sockets: int, rooms: int):
+    """Insert one user per socket, one server and its rooms, returns (room ids, tokens)"""
+    from jose import jwt
+
+    from Database.db import sessionLocal
+    from models.room import Room
+    from models.server import Server
+    from models.serveruser import ServerUser
+    from models.user import User
+    from Routers.auth import ALGORITHM, SECRET_KEY
+
+    db = sessionLocal()
+    try:
+        users = [User(username=f"bench-{i}", password="-") for i in range(sockets)]
+        db.add_all(users)
+        db.flush()
+        server = Server(name="bench", admin_id=users[0].id)
+        db.add(server)
+        db.flush()
+        room_objs = [Room(name=f"room-{i}", description="", server_id=server.id) for i in range(rooms)]
+        db.add_all(room_objs)
+        db.add_all([ServerUser(user_id=user.id, server_id=server.id, role="member") for user in users])
+        db.commit()
+        expire = datetime.utcnow() + timedelta(hours=2)
+        tokens = [
+            jwt.encode({"sub": user.id, "username": user.username, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+            for user in users
+        ]
+        return [room.id for room in room_objs], tokens
+    finally:
+        db.close()
+
+
+class AppServer:
+    """uvicorn running the app on a background thread"""
+
+    def __init__(self, app):
+        import uvicorn
+
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning",
+                                                    ws_ping_interval=None))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> int:
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self.server.servers[0].sockets[0].getsockname()[1]
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+
+async def drive(port, room_ids, tokens, args):
+    import websockets
+
+    latencies = []
+    received = 0
+    connect_sem = asyncio.Semaphore(args.connect_concurrency)
+
+    async def open_socket(i):
+        room_id = room_ids[i % len(room_ids)]
+        async with connect_sem:
+            return await websockets.connect(f"ws://127.0.0.1:{port}/ws/{room_id}?token={tokens[i]}",
+                                            ping_interval=None, open_timeout=60, max_queue=None)
+
+    async def reader(ws):
+        nonlocal received
+        try:
+            async for frame in ws:
+                now = time.perf_counter()
+                payload = json.loads(frame)
+                if payload.get("type") == "ping":
+                    await ws.send('{"type":"pong"}')
+                    continue
+                content = payload.get("content")
+                if content and content.startswith("{"):
+                    latencies.append(now - json.loads(content)["t"])
+                    received += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    start = time.perf_counter()
+    sockets = await asyncio.gather(*(open_socket(i) for i in range(args.sockets)))
+    connect_seconds = time.perf_counter() - start
+    readers = [asyncio.create_task(reader(ws)) for ws in sockets]
+
+    senders = sockets[:max(1, min(args.senders, len(sockets)))]
+    interval = 1 / args.rate
+    sent = 0
+    cpu_start, run_start = cpu_seconds(), time.perf_counter()
+    next_send = run_start
+    while time.perf_counter() - run_start < args.duration:
+        ws = senders[sent % len(senders)]
+        await ws.send(json.dumps({"n": sent, "t": time.perf_counter(), "pad": "x" * args.payload}))
+        sent += 1
+        next_send += interval
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    # give the last broadcasts time to land
+    await asyncio.sleep(args.drain)
+    run_seconds = time.perf_counter() - run_start
+    cpu_used = cpu_seconds() - cpu_start
+
+    await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+    await asyncio.gather(*readers, return_exceptions=True)
+
+    expected = sent * args.sockets // len(room_ids)
+    return {
+        "connect_seconds": round(connect_seconds, 3),
+        "sent": sent,
+        "deliveries": received,
+        "expected_deliveries": expected,
+        "messages_per_sec": round(sent / args.duration, 1),
+        "deliveries_per_sec": round(received / run_seconds, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+            "p99": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+            "max": round(max(latencies) * 1000, 3) if latencies else None,
+            "mean": round(statistics.fmean(latencies) * 1000, 3) if latencies else None,
+        },
+        "cpu_seconds": round(cpu_used, 3),
+        "cpu_percent": round(cpu_used / run_seconds * 100, 1),
+    }
+
+
+def run(args):
+    raise_fd_limit(args.sockets)
+    workdir = tempfile.mkdtemp(prefix="pingspace-bench-")
+    # read by Database/config.py when the app is imported below
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'chat.db')}"
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if backend not in sys.path:
+        sys.path.insert(0, backend)
+
+    import main as app_module
+    from utils import rate_limit
+
+    if not args.rate_limit:
+        # measure fan-out, not the per-user message limit
+        rate_limit.RATE_LIMITS["ws_message"] = (10 ** 9, 10 ** 9)
+
+    room_ids, tokens = provision(args.sockets, args.rooms)
+    server = AppServer(app_module.app)
+    port = server.start()
+    rss_before = rss_bytes()
+    try:
+        result = asyncio.run(drive(port, room_ids, tokens, args))
+    finally:
+        server.stop()
+    result.update({
+        "config": {
+            "sockets": args.sockets,
+            "rooms": args.rooms,
+            "senders": args.senders,
+            "rate": args.rate,
+            "duration": args.duration,
+            "payload": args.payload,
+        },
+        "rss_mb": round(rss_bytes() / 2 ** 20, 1),
+        "rss_growth_mb": round((rss_bytes() - rss_before) / 2 ** 20, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "label": args.label,
+        "database": os.path.join(workdir, "chat.db"),
+    })
+    return result
+
+
+def add_arguments(parser):
+    parser.add_argument("--sockets", type=int, default=1000, help="concurrent /ws/{room_id} connections")
+    parser.add_argument("--rooms", type=int, default=10, help="rooms the sockets are spread over")
+    parser.add_argument("--senders", type=int, default=50, help="sockets that send messages")
+    parser.add_argument("--rate", type=float, default=100, help="messages per second over all senders")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of sending")
+    parser.add_argument("--payload", type=int, default=64, help="padding bytes per message")
+    parser.add_argument("--drain", type=float, default=2, help="seconds to wait for the last deliveries")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--rate-limit", action="store_true", help="keep the per-user message rate limit on")
+    parser.add_argument("--label", default=None, help="free-form tag stored in the report, e.g. a commit")
+    parser.add_argument("--json", default=None, help="write the report to this file")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    result = run(args)
+    report = json.dumps(result, indent=2)
+    print(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Query count check: SQL statements per request on the listing and creation routes.
+
+Boots the app with TestClient against a temp SQLite database, counts the
+statements each request executes (auth and membership caches warm, the way
+a session's second request sees them) and fails when a route goes over its
+budget or its count grows with the number of rows it returns (an N+1).
+Run from the Backend directory:
+
+    python -m bench.query_counts
+"""
+from bench.checks import run, signup, temp_app_env
+
+# route -> statements allowed per request
+BUDGETS = {
+    "POST /servers": 2,
+    "GET /servers": 1,
+    "GET /servers/{server_id}": 1,
+    "GET /rooms/{server_id}": 1,
+    "GET /server_user/{server_id}": 2,
+    "GET /messages/{room_id}": 1,
+}
+# sizes compared for the N+1 check
+SMALL, LARGE = 1, 25
+
+
+class StatementCounter:
+    def __init__(self, engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self.on_execute)
+
+    def on_execute(self, *args):
+        self.count += 1
+
+    def measure(self, request):
+        self.count = 0
+        response = request()
+        assert response.status_code == 200, response.text
+        return self.count, response.json()
+
+
+def check():
+    temp_app_env("pingspace-queries-")
+
+    from fastapi.testclient import TestClient
+
+    import main
+    from Database.db import async_engine, engine
+
+    counter = StatementCounter([engine, async_engine.sync_engine])
+    results = {}  # route -> [(rows returned, statements)]
+
+    def record(route, request, rows=lambda body: None):
+        count, body = counter.measure(request)
+        results.setdefault(route, []).append((rows(body), count))
+        return body
+
+    with TestClient(main.app) as client:
+        def login(username):
+            user_id, headers = signup(client, username)
+            client.get("/servers", headers=headers)  # warm the token and user caches
+            return user_id, headers
+
+        _, owner = login("owner")
+        member_ids = [login(f"member-{i}")[0] for i in range(LARGE)]
+
+        servers = []
+        for i in range(LARGE):
+            body = record("POST /servers", lambda: client.post("/servers", json={"name": f"s{i}"}, headers=owner))
+            servers.append(body["id"])
+        small, large = servers[0], servers[1]
+
+        rooms = client.post("/rooms/bulk", json={"server_id": large, "rooms": [{"name": f"r{i}"} for i in range(LARGE)]},
+                            headers=owner).json()
+        client.post("/rooms", json={"name": "only", "server_id": small}, headers=owner)
+        client.post("/server/join/bulk", json={"server_id": large, "user_ids": member_ids}, headers=owner)
+
+        # the owner is in every server, a fresh user in one
+        single_id, single = login("single")
+        client.post("/server/join", json={"user_id": single_id, "server_id": small}, headers=owner)
+        for headers in (single, single, owner, owner):
+            # twice each, the first call warms the membership cache
+            record("GET /servers", lambda: client.get("/servers", headers=headers), len)
+
+        for server_id in (small, small, large, large):
+            record("GET /servers/{server_id}", lambda: client.get(f"/servers/{server_id}", headers=owner))
+            record("GET /rooms/{server_id}", lambda: client.get(f"/rooms/{server_id}", headers=owner), len)
+            record("GET /server_user/{server_id}", lambda: client.get(f"/server_user/{server_id}", headers=owner), len)
+
+        room_id = rooms[0]["id"]
+        for _ in range(3):
+            record("GET /messages/{room_id}", lambda: client.get(f"/messages/{room_id}", headers=owner))
+
+    failures = {}
+    for route, samples in results.items():
+        # the first request of a pair may still fill a cache, judge the warm ones
+        warm = samples[1::2] if len(samples) > 1 else samples
+        worst = max(count for _, count in warm)
+        by_size = {}
+        for rows, count in warm:
+            by_size[rows] = max(by_size.get(rows, 0), count)
+        problems = []
+        if worst > BUDGETS[route]:
+            problems.append(f"{worst} statements, budget {BUDGETS[route]}")
+        if len(set(by_size.values())) > 1:
+            problems.append(f"count grows with rows: {by_size}")
+        print(f"{'FAIL' if problems else 'ok  '} {route}: {worst} statements (rows -> statements {by_size})")
+        if problems:
+            failures[route] = problems
+    return failures
+
+
+def main():
+    run(check, "routes over their query budget")
+
+
+if __name__ == "__main__":
+    main()
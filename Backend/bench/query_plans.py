@@ -0,0 +1,89 @@
+"""Query plan check for the hot lookups in Routers/chat.py.
+
+Builds the schema in an in-memory SQLite database, runs EXPLAIN QUERY PLAN
+on each hot query and fails when one of them falls back to a full table
+scan or sorts through a temp b-tree. Run from the Backend directory:
+
+    python -m bench.query_plans
+"""
+import sys
+
+from sqlalchemy import create_engine, select
+
+from Database.db import Base
+from models.message import Message
+from models.room import Room
+from models.server import Server
+from models.serveruser import ServerUser
+from models.tombstone import MessageTombstone
+from models.user import User
+
+# name -> statement, mirroring the filters used by the routes
+HOT_QUERIES = {
+    "history page": select(Message)
+        .filter(Message.room_id == "r", Message.seq < 100)
+        .order_by(Message.seq.desc())
+        .limit(51),
+    "history latest": select(Message)
+        .filter(Message.room_id == "r")
+        .order_by(Message.seq.desc())
+        .limit(51),
+    "messages after": select(Message)
+        .filter(Message.room_id == "r", Message.seq > 100)
+        .order_by(Message.seq.asc())
+        .limit(501),
+    "tombstones after": select(MessageTombstone.id, MessageTombstone.message_id)
+        .filter(MessageTombstone.room_id == "r", MessageTombstone.id > 10)
+        .order_by(MessageTombstone.id)
+        .limit(1001),
+    "membership check": select(ServerUser)
+        .filter(ServerUser.user_id == "u", ServerUser.server_id == "s"),
+    "admin check": select(ServerUser)
+        .filter(ServerUser.server_id == "s", ServerUser.user_id == "u", ServerUser.role == "admin"),
+    "room duplicate check": select(Room).filter(Room.server_id == "s", Room.name == "general"),
+    "rooms by server": select(Room).filter(Room.server_id == "s"),
+    "user by username": select(User).filter(User.username == "alice"),
+    "user by id": select(User).filter(User.id == "u"),
+    "message by id": select(Message).filter(Message.id == "m"),
+    "server by id": select(Server).filter(Server.id == "s"),
+}
+
+
+def query_plan(conn, statement):
+    compiled = statement.compile(dialect=conn.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def problems(plan):
+    """Plan steps that mean the query no longer has a usable index"""
+    return [
+        step for step in plan
+        if (step.startswith("SCAN ") and "COVERING INDEX" not in step) or "TEMP B-TREE" in step
+    ]
+
+
+def check():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    failures = {}
+    with engine.connect() as conn:
+        for name, statement in HOT_QUERIES.items():
+            plan = query_plan(conn, statement)
+            bad = problems(plan)
+            print(f"{'FAIL' if bad else 'ok  '} {name}: {' / '.join(plan)}")
+            if bad:
+                failures[name] = bad
+    return failures
+
+
+def main():
+    failures = check()
+    if failures:
+        print(f"{len(failures)} hot queries regressed to a table scan", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
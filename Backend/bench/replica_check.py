@@ -0,0 +1,91 @@
+"""Replica routing check with a second SQLite file standing in for the replica.
+
+The primary and the replica are two temp files. "Replication" is an explicit
+copy with the SQLite backup API, so the replica lags until it is called.
+The check verifies that read-only routes are served by the replica, that a
+caller is pinned to the primary right after their own write and that the
+pin expires. Run from the Backend directory:
+
+    python -m bench.replica_check
+"""
+import os
+import sqlite3
+import time
+
+from bench.checks import DATABASE_FILE, Expectations, run, signup, temp_app_env
+
+STICKY_SECONDS = 1
+
+
+def check():
+    workdir = temp_app_env("pingspace-replica-", READ_AFTER_WRITE_SECONDS=STICKY_SECONDS)
+    primary_path = os.path.join(workdir, DATABASE_FILE)
+    replica_path = os.path.join(workdir, "replica.db")
+    os.environ["DATABASE_REPLICA_URLS"] = f"sqlite:///{replica_path}"
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    import main
+    from Database.db import engine, replica_engines
+
+    statements = {"primary": 0, "replica": 0}
+    event.listen(engine, "before_cursor_execute", lambda *a: statements.__setitem__("primary", statements["primary"] + 1))
+    event.listen(replica_engines[0], "before_cursor_execute",
+                 lambda *a: statements.__setitem__("replica", statements["replica"] + 1))
+
+    def replicate():
+        source, target = sqlite3.connect(primary_path), sqlite3.connect(replica_path)
+        source.backup(target)
+        source.close()
+        target.close()
+
+    def served_by(request):
+        before = dict(statements)
+        response = request()
+        assert response.status_code == 200, response.text
+        used = [name for name in statements if statements[name] != before[name]]
+        return used, response.json()
+
+    expect = Expectations()
+
+    with TestClient(main.app) as client:
+        _, headers = signup(client, "alice")
+        server = client.post("/servers", json={"name": "first"}, headers=headers).json()
+        room = client.post("/rooms", json={"name": "general", "server_id": server["id"]}, headers=headers).json()
+        replicate()
+
+        used, body = served_by(lambda: client.get("/servers", headers=headers))
+        expect("read after own write", used == ["primary"], f"served by {used}")
+
+        time.sleep(STICKY_SECONDS + 0.2)
+        used, body = served_by(lambda: client.get("/servers", headers=headers))
+        expect("read once the pin expired", used == ["replica"], f"served by {used}")
+        used, _ = served_by(lambda: client.get(f"/rooms/{server['id']}", headers=headers))
+        expect("rooms listing", used == ["replica"], f"served by {used}")
+        used, _ = served_by(lambda: client.get(f"/server_user/{server['id']}", headers=headers))
+        expect("member listing", used == ["replica"], f"served by {used}")
+        used, _ = served_by(lambda: client.get(f"/messages/{room['id']}", headers=headers))
+        expect("history, cold buffer warmed from the primary", "primary" in used and "replica" in used,
+               f"served by {used}")
+
+        client.post("/servers", json={"name": "second"}, headers=headers)
+        used, body = served_by(lambda: client.get("/servers", headers=headers))
+        expect("new server visible to its creator", used == ["primary"] and len(body) == 2,
+               f"served by {used}, {len(body)} servers")
+
+        time.sleep(STICKY_SECONDS + 0.2)
+        _, body = served_by(lambda: client.get("/servers", headers=headers))
+        expect("replica lags until replicated", len(body) == 1, f"{len(body)} servers")
+        replicate()
+        _, body = served_by(lambda: client.get("/servers", headers=headers))
+        expect("replica caught up", len(body) == 2, f"{len(body)} servers")
+    return expect.failures
+
+
+def main():
+    run(check, "replica routing checks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Local Redis-protocol stand-in for trying the pub/sub broker without Redis.
+
+Implements just the commands PingSpace uses. Start it and point the workers
+at it from the Backend directory:
+
+    python -m bench.resp_standin --port 6390
+    BROKER_URL=redis://127.0.0.1:6390 uvicorn main:app --workers 2
+"""
+import argparse
+import asyncio
+import fnmatch
+import time
+
+from utils.resp import RespConnection
+
+
+def encode_reply(items) -> bytes:
+    """RESP array of bulk strings and integers"""
+    out = [b"*%d\r\n" % len(items)]
+    for item in items:
+        if isinstance(item, int):
+            out.append(b":%d\r\n" % item)
+        else:
+            out.append(b"$%d\r\n%s\r\n" % (len(item), item))
+    return b"".join(out)
+
+
+class RespStandIn:
+    def __init__(self):
+        self.subscribers = {}  # writer -> set of patterns
+        self.connections = set()  # every client writer, so a restart can drop them
+        self.counters = {}  # key -> (value, expires_at or None)
+
+    async def handle(self, reader, writer):
+        conn = RespConnection(reader, writer)
+        self.connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await conn.read()
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    return
+                command = request[0].decode().upper()
+                args = request[1:]
+                handler = getattr(self, f"cmd_{command.lower()}", None)
+                if handler is None:
+                    writer.write(b"-ERR unknown command '%s'\r\n" % command.encode())
+                else:
+                    writer.write(handler(writer, *args))
+                await writer.drain()
+        finally:
+            self.subscribers.pop(writer, None)
+            self.connections.discard(writer)
+            writer.close()
+
+    def drop_connections(self):
+        """Close every client connection, the way a server restart would"""
+        for writer in list(self.connections):
+            writer.close()
+
+    def cmd_ping(self, writer, *args):
+        return b"+PONG\r\n"
+
+    def cmd_psubscribe(self, writer, *patterns):
+        subscribed = self.subscribers.setdefault(writer, set())
+        out = []
+        for pattern in patterns:
+            subscribed.add(pattern.decode())
+            out.append(encode_reply([b"psubscribe", pattern, len(subscribed)]))
+        return b"".join(out)
+
+    def _counter(self, key):
+        value, expires_at = self.counters.get(key, (0, None))
+        if expires_at is not None and expires_at <= time.monotonic():
+            return 0, None
+        return value, expires_at
+
+    def cmd_set(self, writer, key, value, *options):
+        _, expires_at = self.counters.get(key, (0, None))
+        exists = key in self.counters and (expires_at is None or expires_at > time.monotonic())
+        if exists and b"NX" in (option.upper() for option in options):
+            return b"$-1\r\n"
+        self.counters[key] = (int(value), None)
+        return b"+OK\r\n"
+
+    def cmd_incr(self, writer, key):
+        value, expires_at = self._counter(key)
+        self.counters[key] = (value + 1, expires_at)
+        return b":%d\r\n" % (value + 1)
+
+    def cmd_pexpire(self, writer, key, milliseconds):
+        if key not in self.counters:
+            return b":0\r\n"
+        value, _ = self._counter(key)
+        self.counters[key] = (value, time.monotonic() + int(milliseconds) / 1000)
+        return b":1\r\n"
+
+    def cmd_publish(self, writer, channel, message):
+        receivers = 0
+        for subscriber, patterns in list(self.subscribers.items()):
+            for pattern in patterns:
+                if fnmatch.fnmatchcase(channel.decode(), pattern):
+                    subscriber.write(encode_reply([b"pmessage", pattern.encode(), channel, message]))
+                    receivers += 1
+        return b":%d\r\n" % receivers
+
+
+async def serve(host, port):
+    standin = RespStandIn()
+    server = await asyncio.start_server(standin.handle, host, port)
+    print(f"RESP stand-in listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
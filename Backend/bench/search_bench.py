@@ -0,0 +1,150 @@
+"""Benchmark: GET /search latency on a large synthetic message corpus.
+
+Builds (or reuses, with --db) a SQLite database of --messages messages whose
+words follow a Zipf distribution over --vocabulary words, spread over rooms
+in --servers servers. The searching user belongs to half of the servers, so
+every query also pays for the membership scoping. The FTS index is built
+the way a deploy backfills it (one 'rebuild' after the rows exist), then
+search_messages is timed for rare, mid-frequency, common and two-term
+queries. Run from the Backend directory:
+
+    python -m bench.search_bench --messages 10000000 --db /tmp/search-corpus.db
+    python -m bench.search_bench --messages 200000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from Database.config import apply_sqlite_pragmas, engine_options
+from Database.db import Base
+from Database.search import ensure_search_index, search_messages
+from models.message import Message
+from models.room import Room
+from models.server import Server
+from models.serveruser import ServerUser
+from models.user import User
+
+USER_ID = "search-bench-user"
+
+
+def word(rank: int) -> str:
+    return f"w{rank}"
+
+
+def build(engine, args):
+    rng = random.Random(args.seed)
+    server_ids = [str(uuid.uuid1()) for _ in range(args.servers)]
+    room_ids = [str(uuid.uuid1()) for _ in range(args.rooms)]
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"id": USER_ID, "username": "search-bench", "password": "-"}])
+        conn.execute(insert(Server), [{"id": server_id, "name": server_id, "admin_id": USER_ID} for server_id in server_ids])
+        conn.execute(insert(Room), [{"id": room_id, "name": room_id, "description": "", "server_id": server_ids[i % len(server_ids)]}
+                                    for i, room_id in enumerate(room_ids)])
+        conn.execute(insert(ServerUser), [{"id": str(uuid.uuid1()), "user_id": USER_ID, "server_id": server_id, "role": "member"}
+                                          for server_id in server_ids[::2]])
+
+    ranks = range(1, args.vocabulary + 1)
+    cum_weights = list(accumulate(1 / rank for rank in ranks))
+    start = datetime(2025, 1, 1)
+    last_seq = dict.fromkeys(room_ids, 0)
+    written = 0
+    while written < args.messages:
+        count = min(args.batch, args.messages - written)
+        rows = []
+        for i in range(count):
+            words = rng.choices(ranks, cum_weights=cum_weights, k=args.words)
+            room_id = room_ids[rng.randrange(len(room_ids))]
+            last_seq[room_id] += 1
+            rows.append({
+                "id": str(uuid.uuid1()),
+                "room_id": room_id,
+                "seq": last_seq[room_id],
+                "sender": "bench",
+                "content": " ".join(word(rank) for rank in words),
+                "timestamp": start + timedelta(seconds=written + i),
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(Message), rows)
+        written += count
+        print(f"  {written}/{args.messages} messages", flush=True)
+
+
+def time_queries(session_factory, queries, repeat):
+    latencies, hits = [], []
+    for _ in range(repeat):
+        for query in queries:
+            with session_factory() as db:
+                start = time.perf_counter()
+                rows = search_messages(db, USER_ID, query, limit=21)
+                latencies.append(time.perf_counter() - start)
+                hits.append(len(rows))
+    latencies.sort()
+    return {
+        "queries": len(latencies),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "avg_results": round(statistics.fmean(hits), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--words", type=int, default=12, help="words per message")
+    parser.add_argument("--servers", type=int, default=50)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=50_000, help="rows per insert transaction")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of every query")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", default=None, help="corpus file, reused when it already exists")
+    parser.add_argument("--json", default=None, help="write the report to this file")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="pingspace-search-"), "corpus.db")
+    reuse = os.path.exists(path)
+    url = f"sqlite:///{path}"
+    engine = create_engine(url, **engine_options(url))
+    apply_sqlite_pragmas(engine)
+    report = {"messages": args.messages, "database": path}
+
+    if not reuse:
+        Base.metadata.create_all(bind=engine)
+        start = time.perf_counter()
+        build(engine, args)
+        report["insert_seconds"] = round(time.perf_counter() - start, 1)
+    start = time.perf_counter()
+    ensure_search_index(engine)
+    report["index_seconds"] = round(time.perf_counter() - start, 1)
+    report["database_mb"] = round(os.path.getsize(path) / 2 ** 20, 1)
+
+    session_factory = sessionmaker(bind=engine)
+    vocabulary = args.vocabulary
+    classes = {
+        "rare": [word(rank) for rank in range(vocabulary - 10, vocabulary)],
+        "mid": [word(rank) for rank in range(1000, 1010)],
+        "common": [word(rank) for rank in range(1, 11)],
+        "two_terms": [f"{word(rank)} {word(rank + 1)}" for rank in range(100, 110)],
+        "no_match": ["nosuchword"],
+    }
+    report["latency"] = {name: time_queries(session_factory, queries, args.repeat) for name, queries in classes.items()}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
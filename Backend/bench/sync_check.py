@@ -0,0 +1,125 @@
+"""POST /sync check on a temp database.
+
+Walks a client through a reload and a few reconnects: the first sync
+resets, later ones return only the missed messages and deletions. Gaps
+past the caps and cursors older than the tombstone retention reset again,
+and rooms the caller lost access to come back as gone. Run from the
+Backend directory:
+
+    python -m bench.sync_check
+"""
+import uuid
+from datetime import datetime, timedelta
+
+from bench.checks import Expectations, run, signup, temp_app_env
+
+
+def check():
+    temp_app_env("pingspace-sync-")
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event, insert, update
+
+    import main
+    from Database.archive import TOMBSTONE_RETENTION_DAYS, message_archive
+    from Database.db import engine
+    from models.message import Message
+    from models.room import Room
+    from models.tombstone import MessageTombstone
+    from Routers.chat import SYNC_MAX_MESSAGES, MAX_SYNC_ROOMS, tombstone_cursor
+
+    expect = Expectations()
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *a: statements.append(1))
+
+    clock = [datetime.utcnow() - timedelta(hours=1)]
+    last_seq = {}
+
+    def add_messages(room_id, count):
+        rows = []
+        for i in range(count):
+            clock[0] += timedelta(milliseconds=10)
+            last_seq[room_id] = last_seq.get(room_id, 0) + 1
+            rows.append({"id": str(uuid.uuid1()), "room_id": room_id, "sender": "alice",
+                         "content": f"message {i}", "timestamp": clock[0], "seq": last_seq[room_id]})
+        with engine.begin() as conn:
+            conn.execute(insert(Message), rows)
+            conn.execute(update(Room).where(Room.id == room_id).values(last_seq=last_seq[room_id]))
+        return rows
+
+    with TestClient(main.app) as client:
+        alice_id, alice = signup(client, "alice")
+        bob_id, bob = signup(client, "bob")
+        server = client.post("/servers", json={"name": "sync"}, headers=alice).json()
+        client.post("/server/join", json={"user_id": bob_id, "server_id": server["id"]}, headers=alice)
+        room = client.post("/rooms", json={"name": "general", "server_id": server["id"]}, headers=alice).json()
+        other = client.post("/servers", json={"name": "private"}, headers=alice).json()
+        private = client.post("/rooms", json={"name": "secret", "server_id": other["id"]}, headers=alice).json()
+
+        def sync(entries, headers=bob):
+            response = client.post("/sync", json={"rooms": entries}, headers=headers)
+            return response.status_code, response.json()
+
+        add_messages(room["id"], 5)
+        status, body = sync([{"room_id": room["id"]}])
+        first = body["rooms"][0]
+        expect("first sync resets", status == 200 and first["reset"], str(first))
+
+        loaded = client.get(f"/messages/{room['id']}", headers=bob).json()["messages"]
+        newest = loaded[0]
+        state = {"room_id": room["id"], "last_seq": newest["seq"], "tombstone_cursor": first["tombstone_cursor"]}
+
+        missed = add_messages(room["id"], 3)
+        client.delete(f"/messages/{loaded[2]['id']}", headers=alice)
+        client.delete(f"/messages/{missed[1]['id']}", headers=alice)
+        del statements[:]
+        status, body = sync([state])
+        result = body["rooms"][0]
+        expect("missed messages", [m["id"] for m in result["messages"]] == [missed[0]["id"], missed[2]["id"]],
+               f"{len(result['messages'])} messages")
+        expect("missed deletions", result["deleted"] == [loaded[2]["id"], missed[1]["id"]], str(result["deleted"]))
+        expect("statements per synced room", len(statements) <= 6, f"{len(statements)} statements")
+
+        last = result["messages"][-1]
+        state.update(last_seq=last["seq"], tombstone_cursor=result["tombstone_cursor"])
+        status, body = sync([state])
+        result = body["rooms"][0]
+        expect("nothing new", not result["messages"] and not result["deleted"] and not result["reset"], str(result))
+
+        add_messages(room["id"], SYNC_MAX_MESSAGES + 1)
+        status, body = sync([state])
+        result = body["rooms"][0]
+        expect("gap past the cap resets", result["reset"] and not result["messages"], f"reset={result['reset']}")
+
+        stale = dict(state, tombstone_cursor=tombstone_cursor(
+            datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS + 1), 0))
+        status, body = sync([stale])
+        expect("cursor past the retention resets", body["rooms"][0]["reset"], str(body["rooms"][0]["reset"]))
+
+        status, body = sync([state, {"room_id": private["id"]}, {"room_id": "missing"}])
+        expect("rooms without access are gone", [r["gone"] for r in body["rooms"]] == [False, True, True],
+               str([r["gone"] for r in body["rooms"]]))
+
+        status, _ = sync([dict(state, tombstone_cursor="not-a-cursor")])
+        expect("invalid cursor", status == 400, str(status))
+        status, _ = sync([{"room_id": room["id"]}] * (MAX_SYNC_ROOMS + 1))
+        expect("too many rooms", status == 400, str(status))
+
+        with engine.begin() as conn:
+            conn.execute(insert(MessageTombstone), [{"message_id": "old", "room_id": room["id"],
+                                                     "deleted_at": datetime.utcnow() - timedelta(days=365)}])
+        pruned = message_archive.prune_tombstones()
+        expect("old tombstones pruned", pruned == 1, f"{pruned} pruned")
+
+        client.delete(f"/rooms/{room['id']}", headers=alice)
+        status, body = sync([state])
+        expect("deleted room is gone", body["rooms"][0]["gone"], str(body["rooms"][0]))
+    return expect.failures
+
+
+def main():
+    run(check, "sync checks")
+
+
+if __name__ == "__main__":
+    main()
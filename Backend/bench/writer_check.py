@@ -0,0 +1,95 @@
+"""Message writer check on a temp database.
+
+While the message table is unavailable (renamed away) flushes fail, the
+queued rows stay queued and the retry delay grows. Once the table is back
+they are all written. A row whose seq is already taken is quarantined and
+the rest of its batch is written. close() keeps retrying until a database
+that comes back late takes the queue. Run from the Backend directory:
+
+    python -m bench.writer_check
+"""
+import asyncio
+import os
+import tempfile
+
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from bench.checks import DATABASE_FILE, Expectations, run
+from Database.message_writer import MessageWriter
+from models import Base, Message, Room
+
+
+async def set_table(engine, available: bool):
+    old, new = ("message_away", "message") if available else ("message", "message_away")
+    async with engine.begin() as conn:
+        await conn.execute(text(f"ALTER TABLE {old} RENAME TO {new}"))
+
+
+async def count_rows(engine) -> int:
+    async with engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(Message))).scalar()
+
+
+async def check_async():
+    expect = Expectations()
+    path = os.path.join(tempfile.mkdtemp(prefix="pingspace-writer-"), DATABASE_FILE)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Room), [{"id": "r", "name": "r", "description": "", "last_seq": 0}])
+    writer = MessageWriter(engine, interval_ms=20, retry_max_ms=200)
+
+    await set_table(engine, False)
+    for i in range(5):
+        await writer.submit("r", "alice", f"during outage {i}")
+    await asyncio.sleep(0.5)
+    expect("rows kept during an outage", len(writer.pending) == 5 and writer.failures >= 2,
+           f"{len(writer.pending)} queued after {writer.failures} failed flushes")
+    expect("retry delay backs off", writer.retry_delay() == 0.2, f"{writer.retry_delay() * 1000:.0f} ms")
+
+    await set_table(engine, True)
+    await asyncio.sleep(0.4)
+    rows = await count_rows(engine)
+    expect("rows written once the database is back", rows == 5 and not writer.pending and not writer.attempts,
+           f"{rows} rows, {len(writer.pending)} queued")
+
+    # seqs 1..5 are flushed, the next block continues at 6, make 7 taken
+    async with engine.begin() as conn:
+        await conn.execute(insert(Message), [{"id": "squatter", "room_id": "r", "sender": "x",
+                                              "content": "taken", "seq": 7}])
+    for i in range(3):
+        await writer.submit("r", "alice", f"batch {i}")
+    await asyncio.sleep(0.2)
+    rows = await count_rows(engine)
+    rejected = [entry["row"]["seq"] for entry in writer.quarantine]
+    expect("only the conflicting row is quarantined", rejected == [7] and writer.quarantined == 1,
+           f"quarantined seqs {rejected}")
+    expect("rest of the batch written", rows == 5 + 1 + 2 and not writer.pending, f"{rows} rows")
+
+    await set_table(engine, False)
+    await writer.submit("r", "alice", "at shutdown")
+
+    async def restore():
+        await asyncio.sleep(0.5)
+        await set_table(engine, True)
+
+    restoring = asyncio.create_task(restore())
+    await asyncio.wait_for(writer.close(), 5)
+    await restoring
+    rows = await count_rows(engine)
+    expect("close waits for the database", rows == 9 and not writer.pending, f"{rows} rows")
+    await engine.dispose()
+    return expect.failures
+
+
+def check():
+    return asyncio.run(check_async())
+
+
+def main():
+    run(check, "writer checks")
+
+
+if __name__ == "__main__":
+    main()
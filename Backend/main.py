@@ -1,12 +1,59 @@
 from fastapi import FastAPI, Request, status, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.exceptions import RequestValidationError
-from Database.db import Base, engine
+from Database.db import Base, engine, async_engine, replica_engines
+from Database.message_writer import message_writer
+from Database.archive import message_archive
+from Database.search import ensure_search_index
 from Routers import chat, auth
-import traceback
+from ws.connection_manager import manager
+from utils.membership import membership_cache
+from ws.recent_messages import recent_messages
+from utils.rate_limit import rate_limiter
+from Routers.auth import password_pool
+from utils.metrics import registry, instrument_engine, MetricsMiddleware
+from contextlib import asynccontextmanager
+import logging
+from utils.logging_config import setup_logging, CorrelationMiddleware
 
-app = FastAPI()
+setup_logging()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    message_writer.start()
+    message_archive.start()
+    await manager.start()
+    yield
+    await manager.close()
+    await message_archive.close()
+    # pending chat messages must reach the database before the worker exits
+    await message_writer.close()
+
+app = FastAPI(lifespan=lifespan)
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+for replica_engine in replica_engines:
+    instrument_engine(replica_engine)
+
+registry.gauge("pingspace_room_sockets", "Sockets subscribed to a room on this worker", ("room_id",),
+               callback=lambda: {(room_id,): len(sockets) for room_id, sockets in list(manager.rooms.items())})
+registry.gauge("pingspace_server_sockets", "Sockets subscribed to server events on this worker", ("server_id",),
+               callback=lambda: {(server_id,): len(sockets) for server_id, sockets in list(manager.servers.items())})
+registry.gauge("pingspace_sockets", "Connected sockets on this worker",
+               callback=lambda: {(): len(manager.clients)})
+registry.counter("pingspace_sockets_reaped_total", "Sockets evicted after missing heartbeats",
+                 callback=lambda: {(): manager.reaped})
+registry.counter("pingspace_socket_send_timeouts_total", "Sockets evicted after a send timed out",
+                 callback=lambda: {(): manager.send_timeouts})
+registry.gauge("pingspace_message_queue_depth", "Chat messages waiting to be written",
+               callback=lambda: {(): len(message_writer.pending)})
+registry.counter("pingspace_messages_quarantined_total", "Chat messages the database rejected, set aside by the writer",
+                 callback=lambda: {(): message_writer.quarantined})
+registry.counter("pingspace_messages_archived_total", "Chat messages moved to the archive",
+                 callback=lambda: {(): message_archive.rows_archived})
 
 # Allowed origins (frontend URLs)
 origins = [
@@ -16,6 +63,10 @@ origins = [
     "http://localhost:4173",
 ]
 
+app.add_middleware(MetricsMiddleware)
+# wraps the metrics layer and the routes so everything they log carries the id
+app.add_middleware(CorrelationMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,  # cannot be "*"
@@ -45,8 +96,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     # Log the error for debugging
-    print(f"Unhandled exception: {exc}")
-    print(traceback.format_exc())
+    logger.error("unhandled exception", exc_info=exc, extra={"method": request.method, "path": request.url.path})
     
     # Check if origin is in allowed origins
     origin = request.headers.get("origin")
@@ -79,6 +129,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     )
 
 Base.metadata.create_all(bind=engine)
+ensure_search_index(engine)
 
 # Routers - No prefix needed
 app.include_router(chat.router)
@@ -90,4 +141,19 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/stats")
+async def stats():
+    return {"fanout": manager.fanout_stats(), "message_writer": message_writer.stats(),
+            "membership_cache": membership_cache.stats(), "password_pool": password_pool.stats(),
+            "recent_messages": recent_messages.stats(), "rate_limiter": rate_limiter.stats(),
+            "heartbeat": manager.heartbeat_stats(), "archive": message_archive.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/memory")
+async def memory_stats():
+    return manager.memory_report()
\ No newline at end of file
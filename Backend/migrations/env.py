@@ -6,11 +6,15 @@ from models.user import User
 from models.server import Server 
 from models.room import Room 
 from models.message import Message
+from models.tombstone import MessageTombstone
 from alembic import context
 from Database.db import Base
+from Database.config import DATABASE_URL
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
+# migrate the same database the app uses
+config.set_main_option("sqlalchemy.url", DATABASE_URL.replace("%", "%%"))
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
@@ -0,0 +1,34 @@
+"""add hot path indexes
+
+Revision ID: 79da8a324f72
+Revises: 496a2c491a60
+Create Date: 2026-10-18 09:10:12.408511
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '79da8a324f72'
+down_revision: Union[str, Sequence[str], None] = '496a2c491a60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # databases bootstrapped by Base.metadata.create_all may already have these
+    op.create_index('ix_message_room_timestamp', 'message', ['room_id', 'timestamp', 'id'], unique=False, if_not_exists=True)
+    op.create_index('ix_server_user_user_server', 'server_user', ['user_id', 'server_id'], unique=False, if_not_exists=True)
+    op.create_index('ix_room_server_name', 'room', ['server_id', 'name'], unique=False, if_not_exists=True)
+    # user.username is declared unique, its unique index already serves the websocket handshake
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_room_server_name', table_name='room', if_exists=True)
+    op.drop_index('ix_server_user_user_server', table_name='server_user', if_exists=True)
+    op.drop_index('ix_message_room_timestamp', table_name='message', if_exists=True)
@@ -0,0 +1,51 @@
+"""add message search index
+
+Revision ID: a41c7e0d2b6f
+Revises: 79da8a324f72
+Create Date: 2026-10-18 09:30:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41c7e0d2b6f'
+down_revision: Union[str, Sequence[str], None] = '79da8a324f72'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("ALTER TABLE message ADD COLUMN IF NOT EXISTS search tsvector "
+                   "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED")
+        op.execute("CREATE INDEX IF NOT EXISTS ix_message_search ON message USING GIN (search)")
+        return
+    # external content table over message.rowid, kept current by the triggers below
+    op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+               "content, content='message', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')")
+    op.execute("CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN "
+               "INSERT INTO message_fts(rowid, content) VALUES (new.rowid, new.content); END")
+    op.execute("CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN "
+               "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.rowid, old.content); END")
+    op.execute("CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content ON message BEGIN "
+               "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.rowid, old.content); "
+               "INSERT INTO message_fts(rowid, content) VALUES (new.rowid, new.content); END")
+    # index the messages that are already there
+    op.execute("INSERT INTO message_fts(message_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_message_search")
+        op.execute("ALTER TABLE message DROP COLUMN IF EXISTS search")
+        return
+    op.execute("DROP TRIGGER IF EXISTS message_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS message_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS message_fts_insert")
+    op.execute("DROP TABLE IF EXISTS message_fts")
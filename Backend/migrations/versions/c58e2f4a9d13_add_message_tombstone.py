@@ -0,0 +1,38 @@
+"""add message tombstone
+
+Revision ID: c58e2f4a9d13
+Revises: a41c7e0d2b6f
+Create Date: 2026-10-18 09:52:07.603114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c58e2f4a9d13'
+down_revision: Union[str, Sequence[str], None] = 'a41c7e0d2b6f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('message_tombstone',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('message_id', sa.String(), nullable=False),
+    sa.Column('room_id', sa.String(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True,
+    if_not_exists=True
+    )
+    op.create_index('ix_message_tombstone_room_id', 'message_tombstone', ['room_id', 'id'], unique=False, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_message_tombstone_room_id', table_name='message_tombstone', if_exists=True)
+    op.drop_table('message_tombstone', if_exists=True)
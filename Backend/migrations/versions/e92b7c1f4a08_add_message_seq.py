@@ -0,0 +1,42 @@
+"""add message seq
+
+Revision ID: e92b7c1f4a08
+Revises: c58e2f4a9d13
+Create Date: 2026-10-18 10:14:36.215870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e92b7c1f4a08'
+down_revision: Union[str, Sequence[str], None] = 'c58e2f4a9d13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('room', sa.Column('last_seq', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('message', sa.Column('seq', sa.Integer(), nullable=True))
+    # number the existing messages of every room in the order they were sent
+    op.execute("UPDATE message SET seq = numbered.n FROM ("
+               "SELECT id, ROW_NUMBER() OVER (PARTITION BY room_id ORDER BY timestamp, id) AS n FROM message"
+               ") AS numbered WHERE numbered.id = message.id")
+    op.execute("UPDATE room SET last_seq = coalesce((SELECT max(seq) FROM message WHERE message.room_id = room.id), 0)")
+    op.create_index('ix_message_room_seq', 'message', ['room_id', 'seq'], unique=True)
+    op.drop_index('ix_message_room_timestamp', table_name='message', if_exists=True)
+    if op.get_bind().dialect.name != 'sqlite':
+        # SQLite would have to rebuild the table for this, renumbering the rowids under message_fts
+        op.alter_column('message', 'seq', nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_message_room_timestamp', 'message', ['room_id', 'timestamp', 'id'], unique=False, if_not_exists=True)
+    op.drop_index('ix_message_room_seq', table_name='message')
+    op.drop_column('message', 'seq')
+    op.drop_column('room', 'last_seq')
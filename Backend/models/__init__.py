@@ -3,5 +3,8 @@ from Database.db import Base
 from models.user import User
 from models.server import Server
 from models.room import Room
+from models.serveruser import ServerUser
+from models.message import Message
+from models.tombstone import MessageTombstone
 
-__all__ = ["User", "Server", "Room", "Base"]
\ No newline at end of file
+__all__ = ["User", "Server", "Room", "ServerUser", "Message", "MessageTombstone", "Base"]
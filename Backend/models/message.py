@@ -1,5 +1,5 @@
 from Database.db import Base 
-from sqlalchemy import Column , Integer ,ForeignKey ,  String , DateTime
+from sqlalchemy import Column , Integer ,ForeignKey ,  String , DateTime , Index
 from datetime import datetime
 from sqlalchemy.orm import relationship
 import uuid
@@ -9,4 +9,9 @@ class Message(Base) :
     sender = Column(String , nullable=False)
     room_id = Column(String , nullable=False)
     content = Column(String , nullable=False)
-    timestamp = Column(DateTime , default=datetime.utcnow)
\ No newline at end of file
+    timestamp = Column(DateTime , default=datetime.utcnow)
+    # position in the room, increasing in the order messages were sent, see Database/sequence.py
+    seq = Column(Integer , nullable=False)
+
+    # history pages, cursors and sync all walk this index
+    __table_args__ = (Index('ix_message_room_seq', 'room_id', 'seq', unique=True),)
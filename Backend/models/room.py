@@ -1,4 +1,4 @@
-from sqlalchemy import Column , Integer , String , DateTime , ForeignKey
+from sqlalchemy import Column , Integer , String , DateTime , ForeignKey , Index
 from Database.db import Base 
 from sqlalchemy.orm import relationship
 import uuid         
@@ -10,4 +10,9 @@ class Room(Base):
     name = Column(String, index=True)
     description = Column(String, nullable=True)
     server_id = Column(String, ForeignKey('server.id', ondelete="CASCADE"))
-    server = relationship('Server', back_populates='rooms')
\ No newline at end of file
+    server = relationship('Server', back_populates='rooms')
+    # highest message seq handed out in this room
+    last_seq = Column(Integer, nullable=False, default=0, server_default='0')
+
+    # room listing per server and the duplicate name check
+    __table_args__ = (Index('ix_room_server_name', 'server_id', 'name'),)
@@ -1,5 +1,5 @@
 from Database.db import Base
-from sqlalchemy import Integer, String, ForeignKey, Column
+from sqlalchemy import Integer, String, ForeignKey, Column, Index
 from sqlalchemy.orm import relationship
 import uuid
 
@@ -14,4 +14,7 @@ class ServerUser(Base):
     role = Column(String)
 
     server = relationship("Server", back_populates="users")
-    user = relationship("User", back_populates="memberships")
\ No newline at end of file
+    user = relationship("User", back_populates="memberships")
+
+    # every membership / admin check filters on (user_id, server_id)
+    __table_args__ = (Index('ix_server_user_user_server', 'user_id', 'server_id'),)
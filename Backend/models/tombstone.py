@@ -0,0 +1,15 @@
+from Database.db import Base
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from datetime import datetime
+
+class MessageTombstone(Base):
+    """One row per deleted message, read by /sync so reconnecting clients drop it too"""
+    __tablename__ = 'message_tombstone'
+    # increasing, the sync cursor of the deletion log
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message_id = Column(String, nullable=False)
+    room_id = Column(String, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # a room's deletions after a cursor; AUTOINCREMENT so SQLite never hands out an id twice
+    __table_args__ = (Index('ix_message_tombstone_room_id', 'room_id', 'id'), {'sqlite_autoincrement': True})
@@ -11,6 +11,50 @@ class MessageResponse(BaseModel):
     room_id: str
     sender: str
     content: str
+    timestamp: datetime | None = None
+    seq: int | None = None
 
     class Config:
         orm_mode = True
+
+class MessagePage(BaseModel):
+    messages: list[MessageResponse]
+    # pass back as before= (or after=, matching the request) for the next page
+    next_cursor: str | None = None
+
+class SearchHit(MessageResponse):
+    # bm25 on SQLite (lower is better), ts_rank on Postgres (higher is better)
+    rank: float
+    snippet: str | None = None
+
+class SearchPage(BaseModel):
+    results: list[SearchHit]
+    # pass back as offset= for the next page
+    next_offset: int | None = None
+
+class SyncRoom(BaseModel):
+    room_id: str
+    # seq of the newest message the client has
+    last_seq: int | None = None
+    # tombstone_cursor returned by the previous sync, or by the reset that preceded loading the room
+    tombstone_cursor: str | None = None
+
+class SyncRequest(BaseModel):
+    rooms: list[SyncRoom]
+
+class SyncRoomResponse(BaseModel):
+    room_id: str
+    # missed messages, oldest first
+    messages: list[MessageResponse] = []
+    # ids of messages deleted since tombstone_cursor
+    deleted: list[str] = []
+    # pass back on the next sync
+    tombstone_cursor: str | None = None
+    # the gap is too large to sync: reload the room through GET /messages/{room_id},
+    # then sync from its newest message with the tombstone_cursor returned here
+    reset: bool = False
+    # the room was deleted or the caller is no longer a member
+    gone: bool = False
+
+class SyncResponse(BaseModel):
+    rooms: list[SyncRoomResponse]
@@ -18,3 +18,11 @@ class RoomResponse(BaseModel):
 
     class Config:
         orm_mode = True
+
+class RoomBulkItem(BaseModel):
+    name: str
+    description: str | None = ""
+
+class RoomBulkCreate(BaseModel):
+    server_id: str
+    rooms: list[RoomBulkItem]
@@ -13,3 +13,12 @@ class ServerUserResponse(BaseModel):
     role: str
     class Config:
         orm_mode = True
+
+class ServerUserBulkCreate(BaseModel):
+    server_id: str
+    user_ids: list[str]
+    role: str = "member"
+
+class ServerUserBulkResponse(BaseModel):
+    added: list[ServerUserResponse]
+    already_members: list[str]
@@ -9,7 +9,6 @@ def create_access_token(data):
         to_encode = data.copy()
         to_encode.update({'exp' : datetime.utcnow() + timedelta(minutes = ACCESS_TOKEN_EXPIRE_MINUTE)})
         # to_encode['exp']  = datetime.utcnow() + timedelta(minutes = ACCESS_TOKEN_EXPIRE_MINUTE)
-        print(to_encode)
         
         return jwt.encode(to_encode , SECRET_KEY , algorithm=ALGORITHM)
 
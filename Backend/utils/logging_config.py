@@ -0,0 +1,180 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+
+# root level, e.g. LOG_LEVEL=DEBUG
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# per module overrides, e.g. LOG_LEVELS="ws=DEBUG,Database.message_writer=WARNING"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# share of DEBUG/INFO records kept for chatty loggers, warnings and errors are never sampled,
+# e.g. LOG_SAMPLE_RATES="ws.connection_manager=0.01"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "ws.connection_manager=0.01")
+# records waiting for the writer thread, past this they are dropped instead of blocking
+LOG_QUEUE_SIZE = 10000
+
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+connection_id: ContextVar[str | None] = ContextVar("connection_id", default=None)
+
+# attributes every LogRecord has, anything else was passed through `extra`
+RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+listener = None
+
+
+def parse_pairs(value: str) -> dict:
+    """"a=1,b=2" -> {"a": "1", "b": "2"}"""
+    pairs = {}
+    for item in value.split(","):
+        name, _, setting = item.strip().partition("=")
+        if name and setting:
+            pairs[name] = setting.strip()
+    return pairs
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the correlation ids and any `extra` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the correlation ids onto the record while still on the calling task"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        record.connection_id = connection_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a share of the low-severity records of high-volume loggers"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return random.random() < rate
+            name = name.rpartition(".")[0]
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never waits on a full queue"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # resolve the message and traceback here, the writer thread only serialises
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: str = LOG_LEVEL, levels: str = LOG_LEVELS, sample_rates: str = LOG_SAMPLE_RATES):
+    """Route the root logger through a queue to a stdout writer thread, safe to call twice"""
+    global listener
+    if listener is not None:
+        return
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter({name: float(rate) for name, rate in parse_pairs(sample_rates).items()}))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
+    for name, module_level in parse_pairs(levels).items():
+        logging.getLogger(name).setLevel(module_level.upper())
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush what is queued and stop the writer thread"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+class CorrelationMiddleware:
+    """Tag everything logged while serving a request (or socket) with an id.
+
+    HTTP requests reuse an incoming X-Request-ID and echo it back, websockets
+    get a fresh connection id for their whole lifetime.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            token = connection_id.set(uuid.uuid4().hex[:16])
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                connection_id.reset(token)
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        incoming = dict(scope["headers"]).get(b"x-request-id")
+        rid = incoming.decode("latin-1")[:64] if incoming else uuid.uuid4().hex[:16]
+        token = request_id.set(rid)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id.reset(token)
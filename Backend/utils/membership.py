@@ -0,0 +1,52 @@
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.serveruser import ServerUser
+from utils.cache import TTLCache
+
+MEMBERSHIP_CACHE_SIZE = 10000
+MEMBERSHIP_TTL_SECONDS = 60
+
+# (user_id, server_id) -> role, None when the user is not a member
+membership_cache = TTLCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_TTL_SECONDS)
+_NOT_CACHED = object()
+
+
+def _role_query(user_id: str, server_id: str):
+    return select(ServerUser.role).filter(ServerUser.user_id == user_id, ServerUser.server_id == server_id)
+
+
+def get_role(db: Session, user_id: str, server_id: str) -> str | None:
+    """Role of a user in a server ("" for a member without one), None if not a member"""
+    key = (user_id, server_id)
+    role = membership_cache.get(key, _NOT_CACHED)
+    if role is _NOT_CACHED:
+        generation = membership_cache.generation
+        row = db.execute(_role_query(user_id, server_id)).first()
+        role = (row.role or "") if row else None
+        if role is not None or not db.info.get("replica"):
+            # a replica may not have a brand new membership yet, never cache that miss
+            membership_cache.set(key, role, generation=generation)
+    return role
+
+
+async def get_role_async(db: AsyncSession, user_id: str, server_id: str) -> str | None:
+    key = (user_id, server_id)
+    role = membership_cache.get(key, _NOT_CACHED)
+    if role is _NOT_CACHED:
+        generation = membership_cache.generation
+        row = (await db.execute(_role_query(user_id, server_id))).first()
+        role = (row.role or "") if row else None
+        membership_cache.set(key, role, generation=generation)
+    return role
+
+
+def invalidate_membership(user_id: str | None = None, server_id: str | None = None):
+    """Forget cached roles for a membership, every member of a server or every server of a user"""
+    if user_id is not None and server_id is not None:
+        membership_cache.invalidate((user_id, server_id))
+    elif server_id is not None:
+        membership_cache.invalidate_where(lambda key: key[1] == server_id)
+    elif user_id is not None:
+        membership_cache.invalidate_where(lambda key: key[0] == user_id)
@@ -0,0 +1,208 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# seconds, tuned for request and query latencies
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+FANOUT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # optional function returning {label values tuple: value}, read on every scrape
+        self.callback = callback
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        if self.callback is not None:
+            return dict(self.callback())
+        with self.lock:
+            return dict(self.values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.samples().items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Cumulative bucket counts, sum and count per label set"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                # per bucket counts (last one is +Inf), sum, count
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            snapshot = {labels: (list(counts), total, count) for labels, (counts, total, count) in self.values.items()}
+        for labels, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=(), callback=None) -> Counter:
+        return self.register(Counter(name, help, labelnames, callback))
+
+    def gauge(self, name, help, labelnames=(), callback=None) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, callback))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "pingspace_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+db_queries_per_request = registry.histogram(
+    "pingspace_db_queries_per_request", "SQL statements executed per HTTP request", ("route",), COUNT_BUCKETS)
+db_time_per_request = registry.histogram(
+    "pingspace_db_seconds_per_request", "Time spent in SQL per HTTP request", ("route",))
+db_query_duration = registry.histogram(
+    "pingspace_db_query_duration_seconds", "Duration of single SQL statements")
+broadcast_fanout_duration = registry.histogram(
+    "pingspace_broadcast_fanout_seconds", "Time to queue one broadcast to every local socket", ("kind",))
+broadcast_recipients = registry.histogram(
+    "pingspace_broadcast_recipients", "Local sockets reached by one broadcast", ("kind",), FANOUT_BUCKETS)
+delivery_latency = registry.histogram(
+    "pingspace_delivery_latency_seconds", "Time from queueing a frame to writing it to the socket", ("kind",))
+rate_limit_rejections = registry.counter(
+    "pingspace_rate_limit_rejections_total", "Requests and messages refused by the rate limiter", ("route",))
+message_persist_latency = registry.histogram(
+    "pingspace_message_persist_seconds", "Time from a chat message being sent to its row being written")
+message_flush_duration = registry.histogram(
+    "pingspace_message_flush_seconds", "Duration of one batched message insert")
+
+# (statement count, seconds in SQL) of the request being served, None outside requests
+request_queries: ContextVar[list | None] = ContextVar("request_queries", default=None)
+
+
+def instrument_engine(engine):
+    """Time every statement on a (sync) engine and charge it to the current request"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_query_duration.observe(elapsed)
+        current = request_queries.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += elapsed
+
+
+class MetricsMiddleware:
+    """Per-route latency and SQL usage for HTTP requests, labelled by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status_code = 500
+        queries = [0, 0.0]
+        token = request_queries.set(queries)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_queries.reset(token)
+            route = scope.get("route")
+            # the template keeps ids out of the labels, unmatched paths share one series
+            route = getattr(route, "path", "unmatched")
+            http_request_duration.observe(elapsed, scope["method"], route, str(status_code))
+            db_queries_per_request.observe(queries[0], route)
+            db_time_per_request.observe(queries[1], route)
@@ -0,0 +1,34 @@
+import base64
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(seq: int) -> str:
+    """History cursor for a message position, its seq"""
+    return str(seq)
+
+
+def decode_cursor(cursor: str | int) -> int:
+    try:
+        seq = int(cursor)
+    except (TypeError, ValueError):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if seq < 0:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return seq
+
+
+def encode_stamped_cursor(timestamp: datetime, position: int) -> str:
+    """Opaque cursor for a position in a log together with the time it was taken"""
+    raw = f"{timestamp.isoformat()}|{position}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_stamped_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, position = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), int(position)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+# bcrypt threads, bcrypt releases the GIL so threads run in parallel
+HASH_WORKERS = 4
+# jobs allowed to wait for a free worker before new ones are rejected with 429
+HASH_QUEUE_SIZE = 32
+
+
+class PasswordPool:
+    """Runs password hashing on a small dedicated pool with bounded queueing.
+
+    Keeps a burst of logins from occupying the request threadpool and the
+    event loop, callers past the queue limit get a 429 instead of waiting.
+    """
+
+    def __init__(self, context, workers: int = HASH_WORKERS, queue_size: int = HASH_QUEUE_SIZE):
+        self.context = context
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        self.limit = workers + queue_size
+        self.in_flight = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _release(self, _future):
+        with self.lock:
+            self.in_flight -= 1
+
+    async def run(self, fn, *args):
+        with self.lock:
+            if self.in_flight >= self.limit:
+                self.rejected += 1
+                raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS,
+                                    detail="Too many password checks in progress, try again shortly",
+                                    headers={"Retry-After": "1"})
+            self.in_flight += 1
+        future = self.executor.submit(fn, *args)
+        # the slot is held until the hash finishes, even if the request goes away
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> tuple[bool, str | None]:
+        """Verify a password, also returning a new hash when the stored one uses outdated settings"""
+        return await self.run(self.context.verify_and_update, password, hashed)
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "rejected": self.rejected}
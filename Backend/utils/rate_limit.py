@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.metrics import rate_limit_rejections
+from utils.resp import SharedConnection
+
+logger = logging.getLogger(__name__)
+
+# route -> (burst size, tokens refilled per second)
+RATE_LIMITS = {
+    "ws_message": (10, 1.0),
+    "post_message": (10, 1.0),
+}
+# (route, user id) -> (burst size, refill per second) for individual users
+USER_RATE_LIMITS = {}
+DEFAULT_RATE_LIMIT = (10, 1.0)
+# buckets untouched for this long are forgotten (they would be full again anyway)
+IDLE_EVICT_SECONDS = 300
+# "memory://" limits per worker, "redis://host:port/db" shares the limit between workers
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "memory://")
+RATE_LIMIT_PREFIX = "pingspace:rl:"
+
+
+def limit_for(route: str, key: str) -> tuple[int, float]:
+    return USER_RATE_LIMITS.get((route, key)) or RATE_LIMITS.get(route, DEFAULT_RATE_LIMIT)
+
+
+class TokenBucketLimiter:
+    """O(1) token bucket per (route, key) on the monotonic clock"""
+
+    def __init__(self, idle_seconds: float = IDLE_EVICT_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.buckets = OrderedDict()  # (route, key) -> (tokens, last update), least recently used first
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self, route: str, key: str) -> bool:
+        capacity, rate = limit_for(route, key)
+        now = time.monotonic()
+        with self.lock:
+            bucket_key = (route, key)
+            bucket = self.buckets.pop(bucket_key, None)
+            tokens = capacity if bucket is None else min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.rejected += 1
+                rate_limit_rejections.inc(route)
+            self.buckets[bucket_key] = (tokens, now)
+            self._evict_idle(now)
+        return allowed
+
+    def _evict_idle(self, now: float):
+        # oldest first, so stop at the first bucket that is still in use
+        while self.buckets:
+            bucket_key, (_, updated) = next(iter(self.buckets.items()))
+            if now - updated < self.idle_seconds:
+                break
+            del self.buckets[bucket_key]
+
+    async def hit(self, route: str, key: str) -> bool:
+        return self.allow(route, key)
+
+    def stats(self):
+        return {"backend": "memory", "buckets": len(self.buckets), "rejected": self.rejected}
+
+
+class SharedRateLimiter:
+    """Limit shared by every worker through a Redis-protocol server.
+
+    Approximates the bucket with a fixed window of capacity / rate seconds
+    that admits `capacity` hits, one INCR + PEXPIRE round trip per check.
+    Falls back to the local bucket when the server cannot be reached or
+    does not answer within RESP_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self, url: str, prefix: str = RATE_LIMIT_PREFIX):
+        self.url = url
+        self.prefix = prefix
+        self.redis = SharedConnection(url)
+        self.fallback = TokenBucketLimiter()
+        self.rejected = 0
+
+    async def hit(self, route: str, key: str) -> bool:
+        capacity, rate = limit_for(route, key)
+        window_ms = int(capacity / rate * 1000)
+        window = int(time.time() * 1000) // window_ms
+        counter = f"{self.prefix}{route}:{key}:{window}"
+        try:
+            count, _ = await self.redis.pipeline(("INCR", counter), ("PEXPIRE", counter, window_ms * 2))
+        except Exception as e:
+            logger.warning("shared rate limiter unavailable, limiting locally", extra={"error": repr(e)})
+            return self.fallback.allow(route, key)
+        if count > capacity:
+            self.rejected += 1
+            rate_limit_rejections.inc(route)
+            return False
+        return True
+
+    def stats(self):
+        return {"backend": "shared", "rejected": self.rejected + self.fallback.rejected}
+
+
+def create_rate_limiter(url: str = RATE_LIMIT_URL):
+    if url.startswith("memory://"):
+        return TokenBucketLimiter()
+    if url.startswith("redis://"):
+        return SharedRateLimiter(url)
+    raise ValueError(f"Unsupported rate limit backend: {url}")
+
+
+rate_limiter = create_rate_limiter()
@@ -0,0 +1,124 @@
+import asyncio
+from urllib.parse import urlsplit
+
+# a command round trip that takes longer fails, the caller falls back
+RESP_TIMEOUT_SECONDS = 1.0
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+class RespConnection:
+    """Minimal RESP2 client, enough for pub/sub and a few counter commands"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, url: str) -> "RespConnection":
+        parts = urlsplit(url)
+        reader, writer = await asyncio.open_connection(parts.hostname or "localhost", parts.port or 6379)
+        conn = cls(reader, writer)
+        if parts.password:
+            await conn.command("AUTH", parts.password)
+        db = parts.path.lstrip("/")
+        if db and db != "0":
+            await conn.command("SELECT", db)
+        return conn
+
+    @staticmethod
+    def encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    async def send(self, *args):
+        self.writer.write(self.encode(args))
+        await self.writer.drain()
+
+    async def read(self):
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size == -1:
+                return None
+            return (await self.reader.readexactly(size + 2))[:-2]
+        if kind == b"*":
+            size = int(rest)
+            if size == -1:
+                return None
+            return [await self.read() for _ in range(size)]
+        raise RespError(f"Unexpected reply type {kind!r}")
+
+    async def command(self, *args):
+        async with self.lock:
+            await self.send(*args)
+            return await self.read()
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+
+class SharedConnection:
+    """One lazily opened connection shared by concurrent callers.
+
+    Opening happens behind a lock so concurrent first calls share one
+    socket. A round trip that fails or times out may leave unread replies on
+    the stream, so it drops the connection and the next call opens a new one.
+    """
+
+    def __init__(self, url: str, timeout: float = RESP_TIMEOUT_SECONDS):
+        self.url = url
+        self.timeout = timeout
+        self.conn = None
+        self.opening = None
+
+    async def _connect(self) -> RespConnection:
+        self.opening = self.opening or asyncio.Lock()
+        async with self.opening:
+            if self.conn is None:
+                self.conn = await RespConnection.open(self.url)
+            return self.conn
+
+    async def _round_trip(self, conn: RespConnection, commands) -> list:
+        async with conn.lock:
+            # pipelined, the replies are read back in order
+            for command in commands:
+                await conn.send(*command)
+            return [await conn.read() for _ in commands]
+
+    async def pipeline(self, *commands) -> list:
+        """Send every command, return their replies in order"""
+        conn = self.conn or await asyncio.wait_for(self._connect(), self.timeout)
+        try:
+            return await asyncio.wait_for(self._round_trip(conn, commands), self.timeout)
+        except BaseException:
+            # a caller that failed on an older connection must not drop a newer one
+            if self.conn is conn:
+                self.conn = None
+            await conn.close()
+            raise
+
+    async def close(self):
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
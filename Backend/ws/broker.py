@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+from abc import ABC, abstractmethod
+
+from utils.resp import RespConnection, RespError
+
+logger = logging.getLogger(__name__)
+
+# "memory://" keeps fan-out inside this process, "redis://host:port/db" shares
+# it between every worker subscribed to the same server
+BROKER_URL = os.getenv("BROKER_URL", "memory://")
+CHANNEL_PREFIX = "pingspace:"
+RECONNECT_DELAY_SECONDS = 1
+
+
+class Broker(ABC):
+    """Carries encoded frames published on "room:<id>" / "server:<id>" channels.
+
+    Every worker subscribes and hands what it receives to on_message, which
+    delivers to the sockets connected to that worker only.
+    """
+
+    def attach(self, on_message):
+        self.on_message = on_message
+
+    async def start(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, channel: str, frame: str):
+        ...
+
+    async def close(self):
+        pass
+
+
+class InMemoryBroker(Broker):
+    """Single process broker, publishing is just local delivery"""
+
+    async def publish(self, channel: str, frame: str):
+        self.on_message(channel, frame)
+
+
+class RedisBroker(Broker):
+    """Pub/sub over the Redis protocol, one publishing and one subscribed connection"""
+
+    def __init__(self, url: str, prefix: str = CHANNEL_PREFIX):
+        self.url = url
+        self.prefix = prefix
+        self.publisher = None
+        self.subscriber = None
+        self.listener = None
+
+    async def start(self):
+        self.publisher = await RespConnection.open(self.url)
+        await self._subscribe()
+        self.listener = asyncio.create_task(self._listen())
+
+    async def _subscribe(self):
+        subscriber = await RespConnection.open(self.url)
+        try:
+            await subscriber.send("PSUBSCRIBE", self.prefix + "*")
+            await subscriber.read()
+        except BaseException:
+            await subscriber.close()
+            raise
+        self.subscriber = subscriber
+
+    async def _listen(self):
+        while True:
+            try:
+                reply = await self.subscriber.read()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("broker subscription lost, reconnecting", extra={"error": str(e)})
+                await self._resubscribe()
+                continue
+            if reply and reply[0] == b"pmessage":
+                _, _, channel, data = reply
+                # a frame that fails to deliver must not end the subscription
+                try:
+                    self.on_message(channel.decode()[len(self.prefix):], data.decode())
+                except Exception:
+                    logger.exception("broker delivery failed", extra={"channel": channel.decode(errors="replace")})
+
+    async def _resubscribe(self):
+        if self.subscriber is not None:
+            await self.subscriber.close()
+            self.subscriber = None
+        while True:
+            await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+            try:
+                await self._subscribe()
+                return
+            except (OSError, RespError) as e:
+                logger.warning("broker reconnect failed", extra={"error": str(e)})
+
+    async def publish(self, channel: str, frame: str):
+        try:
+            if self.publisher is None:
+                self.publisher = await RespConnection.open(self.url)
+            await self.publisher.command("PUBLISH", self.prefix + channel, frame)
+        except Exception as e:
+            # broker unreachable, at least deliver to this worker's sockets
+            logger.warning("broker publish failed, delivering locally", extra={"channel": channel, "error": str(e)})
+            self.publisher = None
+            self.on_message(channel, frame)
+
+    async def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+        for conn in (self.publisher, self.subscriber):
+            if conn is not None:
+                await conn.close()
+
+
+def create_broker(url: str = BROKER_URL) -> Broker:
+    if url.startswith("memory://"):
+        return InMemoryBroker()
+    if url.startswith("redis://"):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported broker url: {url}")
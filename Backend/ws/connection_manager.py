@@ -1,131 +1,357 @@
-from fastapi import WebSocket
-
-class ConnectionManager:
-    def __init__(self):
-        self.rooms = {}  # room_id -> [websockets]
-        self.servers = {}  # server_id -> [websockets] for server-level events
-        self.deleted_rooms = {}
-        self.socket_to_username = {}   
-        self.message = {
-        }            
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import deque
 
+from fastapi import WebSocket
 
-    async def connect(self, websocket: WebSocket, room_id :str , username:str):
-        
+from ws.serializer import encode
+from ws.broker import Broker, create_broker
+from ws.recent_messages import recent_messages
+from utils.metrics import broadcast_fanout_duration, broadcast_recipients, delivery_latency
+
+logger = logging.getLogger(__name__)
+
+# Outbound queue settings for every connected socket
+SEND_QUEUE_SIZE = 256
+# "drop_oldest" discards the oldest queued frame when a socket falls behind,
+# "disconnect" closes the slow consumer instead
+OVERFLOW_POLICY = "drop_oldest"
+# the server pings every socket this often, sockets silent for longer than the
+# timeout are reaped, and a single send may block a writer for SEND_TIMEOUT
+HEARTBEAT_INTERVAL = 25
+HEARTBEAT_TIMEOUT = 60
+SEND_TIMEOUT = 10
+
+PING_FRAME = encode({"type": "ping"})
+
+
+def is_heartbeat(text: str) -> bool:
+    """True for the {"type": "pong"} frames clients answer pings with"""
+    if not text.startswith("{") or '"pong"' not in text:
+        return False
+    try:
+        frame = json.loads(text)
+    except ValueError:
+        return False
+    return isinstance(frame, dict) and (frame.get("type") == "pong" or frame.get("action") == "pong")
+
+
+class ClientConnection:
+    """A connected socket with its own bounded send queue and writer task"""
+
+    def __init__(self, manager, websocket: WebSocket, username: str, max_queue: int, policy: str):
+        self.manager = manager
+        self.websocket = websocket
+        self.username = username
+        self.max_queue = max_queue
+        self.policy = policy
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+        self.rooms = set()    # room ids this socket is registered in
+        self.servers = set()  # server ids this socket is registered in
+        # multiplexed sockets stay registered with no subscriptions until detached
+        self.pinned = False
+        self.last_seen = time.monotonic()
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, frame: str, room_key=None) -> bool:
+        """Queue an encoded frame without blocking, applying the overflow policy"""
+        if self.closed:
+            return False
+        if len(self.queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                self.manager.evict(self)
+                return False
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append((frame, room_key, time.perf_counter()))
+        self.wakeup.set()
+        return True
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                frame, room_key, queued_at = self.queue.popleft()
+                # a peer that stopped reading must not hold the writer forever
+                await asyncio.wait_for(self.websocket.send_text(frame), SEND_TIMEOUT)
+                if room_key is not None:
+                    self.manager.record_fanout(room_key, time.perf_counter() - queued_at)
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            self.manager.send_timeouts += 1
+            self.manager.evict(self)
+        except Exception:
+            # send failed, the peer is gone
+            self.manager.evict(self)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.wakeup.set()
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
 
-        if room_id not in self.rooms:
-            self.rooms[room_id] = []
 
-        self.rooms[room_id].append(websocket)
-        print("This are self.rooms" , self.rooms)
-    
+class ConnectionManager:
+    def __init__(self, max_queue: int = SEND_QUEUE_SIZE, overflow_policy: str = OVERFLOW_POLICY,
+                 broker: Broker | None = None, heartbeat_interval: float = HEARTBEAT_INTERVAL,
+                 heartbeat_timeout: float = HEARTBEAT_TIMEOUT):
+        if overflow_policy not in ("drop_oldest", "disconnect"):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        # broadcasts go through the broker so every worker delivers to its own sockets
+        self.broker = broker or create_broker()
+        self.broker.attach(self.deliver)
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.rooms = {}  # room_id -> {websockets}
+        self.servers = {}  # server_id -> {websockets} for server-level events
+        # reverse indexes: websocket -> ClientConnection (which knows its rooms/servers)
+        # and username -> {websockets}
+        self.clients = {}
+        self.users = {}
+        self.fanout = {}  # "room:<id>" / "server:<id>" -> fan-out latency stats
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.heartbeat_task = None
+        self.reaped = 0
+        self.send_timeouts = 0
+
+    def _client(self, websocket: WebSocket, username: str) -> ClientConnection:
+        client = self.clients.get(websocket)
+        if client is None:
+            client = ClientConnection(self, websocket, username, self.max_queue, self.overflow_policy)
+            self.clients[websocket] = client
+            self.users.setdefault(username, set()).add(websocket)
+        return client
+
+    def attach(self, websocket: WebSocket, username: str) -> ClientConnection:
+        """Register a multiplexed socket that subscribes to rooms and servers later"""
+        client = self._client(websocket, username)
+        client.pinned = True
+        return client
+
+    def detach(self, websocket: WebSocket):
+        """Drop a socket from every room and server it joined"""
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        client.pinned = False
+        for room_id in list(client.rooms):
+            self.disconnect(websocket, room_id)
+        for server_id in list(client.servers):
+            self.disconnect_from_server(websocket, server_id)
+        self._release(client)
+
+    def touch(self, websocket: WebSocket):
+        """Record that a frame arrived from the socket"""
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.last_seen = time.monotonic()
+
+    def subscriptions(self, websocket: WebSocket) -> int:
+        client = self.clients.get(websocket)
+        return 0 if client is None else len(client.rooms) + len(client.servers)
 
-        self.socket_to_username[websocket] = username
+    async def connect(self, websocket: WebSocket, room_id :str , username:str):
+        self.rooms.setdefault(room_id, set()).add(websocket)
+        self._client(websocket, username).rooms.add(room_id)
+        logger.info("joined room", extra={"room_id": room_id, "username": username})
 
     async def connect_to_server(self, websocket: WebSocket, server_id: str, username: str):
         """Connect a WebSocket to a server for server-level events (room creation, etc.)"""
-        if server_id not in self.servers:
-            self.servers[server_id] = []
-        
-        self.servers[server_id].append(websocket)
-        self.socket_to_username[websocket] = username
-        print(f"Connected to server {server_id}, total connections: {len(self.servers[server_id])}")
-    async def connect_to_message(self , websocket: WebSocket , payload : object) :
-        if payload.room_id not in self.message :
-            self.message[payload.room_id] = []
-        self.message[payload.room_id].append(payload.message)
-
+        self.servers.setdefault(server_id, set()).add(websocket)
+        self._client(websocket, username).servers.add(server_id)
+        logger.info("joined server", extra={"server_id": server_id, "username": username})
 
     async def broadcast_delete_message(self , room_id , message_id) :
-        if room_id not in self.message :
-            return
-        # clash : [{message_id : 1 , content : "kch hoga" }]
-        messages = self.message[room_id]
-        for i in range(len(messages)) :
-            if messages[i]['message_id'] == message_id :
-                messages.pop(i)
-                break
-        self.message[room_id] = messages
-
-
         payload = {
             "action" : "delete_message",
+            "room_id" : room_id,
             "message_id" : message_id
         }
-
-        if room_id in self.rooms:
-            for conn in list(self.rooms[room_id]):
-                try:
-                    await conn.send_json(payload)
-                except Exception:
-                    pass
-                
-            
-
+        # the recent message buffers drop it when the frame is delivered
+        await self.broadcast(room_id, payload)
 
     def get_all_rooms(self):
         return self.rooms
 
-    def disconnect(self, websocket: WebSocket, room_id: str):
-
-        if room_id in self.rooms and websocket in self.rooms[room_id]:
+    def _release(self, client: ClientConnection):
+        """Stop the writer once a socket is no longer registered anywhere"""
+        if client.rooms or client.servers or client.pinned:
+            return
+        client.close()
+        websocket = client.websocket
+        if self.clients.pop(websocket, None) is None:
+            return
+        logger.info("socket released", extra={"username": client.username, "dropped_frames": client.dropped})
+        sockets = self.users.get(client.username)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del self.users[client.username]
+
+    def _unregister(self, registry: dict, key: str, websocket: WebSocket) -> bool:
+        """Remove a socket from one room/server set, dropping the set once empty"""
+        sockets = registry.get(key)
+        if sockets is None or websocket not in sockets:
+            return False
+        sockets.discard(websocket)
+        if not sockets:
+            del registry[key]
+            return True
+        return False
 
-            self.rooms[room_id].remove(websocket) 
+    def disconnect(self, websocket: WebSocket, room_id: str):
+        if self._unregister(self.rooms, room_id, websocket):
+            # nobody left in the room on this worker
+            self.fanout.pop(f"room:{room_id}", None)
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.rooms.discard(room_id)
+            self._release(client)
 
     def disconnect_from_server(self, websocket: WebSocket, server_id: str):
         """Disconnect a WebSocket from a server"""
-        if server_id in self.servers and websocket in self.servers[server_id]:
-            self.servers[server_id].remove(websocket)
-            if len(self.servers[server_id]) == 0:
-                del self.servers[server_id]
-
-    async def broadcast(self, room_id: str, message):
-
-        if room_id not in self.rooms:
-            return
-
-        stale = []
+        if self._unregister(self.servers, server_id, websocket):
+            self.fanout.pop(f"server:{server_id}", None)
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.servers.discard(server_id)
+            self._release(client)
+
+    def evict(self, client: ClientConnection):
+        """Drop a dead or too slow socket from every room and server it joined"""
+        websocket = client.websocket
+        self.detach(websocket)
+        client.close()
+        asyncio.get_running_loop().create_task(self._close_quietly(websocket))
+
+    def memory_report(self):
+        """Registry sizes and a rough shallow byte count of the containers"""
+        containers = [self.rooms, self.servers, self.clients, self.users, self.fanout]
+        containers += list(self.rooms.values()) + list(self.servers.values()) + list(self.users.values())
+        for client in self.clients.values():
+            containers += [client.rooms, client.servers, client.queue]
+        return {
+            "rooms": len(self.rooms),
+            "servers": len(self.servers),
+            "sockets": len(self.clients),
+            "users": len(self.users),
+            "room_memberships": sum(len(sockets) for sockets in self.rooms.values()),
+            "server_memberships": sum(len(sockets) for sockets in self.servers.values()),
+            "queued_frames": sum(len(client.queue) for client in self.clients.values()),
+            "approx_bytes": sum(sys.getsizeof(container) for container in containers),
+        }
 
-        for connection in list(self.rooms[room_id]):
+    async def _close_quietly(self, websocket: WebSocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    def send_personal(self, websocket: WebSocket, message):
+        """Queue a message for a single socket, behind anything already queued for it"""
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.enqueue(encode(message))
+
+    async def start(self):
+        await self.broker.start()
+        if self.heartbeat_interval and self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def close(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        await self.broker.close()
+
+    def reap(self) -> int:
+        """Evict sockets that have been silent past the timeout and ping the rest"""
+        deadline = time.monotonic() - self.heartbeat_timeout
+        reaped = 0
+        for client in list(self.clients.values()):
+            if client.last_seen < deadline:
+                self.evict(client)
+                reaped += 1
+            else:
+                client.enqueue(PING_FRAME)
+        self.reaped += reaped
+        return reaped
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
             try:
-                await connection.send_json(message)
+                self.reap()
             except Exception:
-                stale.append(connection)
+                logger.exception("heartbeat failed")
+
+    def heartbeat_stats(self):
+        return {"sockets": len(self.clients), "reaped": self.reaped, "send_timeouts": self.send_timeouts}
+
+    def deliver(self, channel: str, frame: str):
+        """Fan a published frame out to the sockets connected to this worker"""
+        kind, _, key = channel.partition(":")
+        if kind == "room":
+            recent_messages.observe(key, frame)
+        registry = self.rooms if kind == "room" else self.servers
+        connections = registry.get(key)
+        if not connections:
+            return
+        start = time.perf_counter()
+        for connection in list(connections):
+            client = self.clients.get(connection)
+            if client is not None:
+                client.enqueue(frame, channel)
+        broadcast_fanout_duration.observe(time.perf_counter() - start, kind)
+        broadcast_recipients.observe(len(connections), kind)
 
-        for connection in stale:
-            try:
-                await connection.close()
-            except:
-                pass
-            self.disconnect(connection, room_id)
+    async def broadcast(self, room_id: str, message):
+        # encode once, every recipient on every worker gets the same text frame
+        await self.broker.publish(f"room:{room_id}", encode(message))
 
     async def broadcast_to_server(self, server_id: str, message):
         """Broadcast a message to all WebSocket connections in a server"""
-        if server_id not in self.servers:
-            return
-
-        stale = []
-
-        for connection in list(self.servers[server_id]):
-            try:
-                await connection.send_json(message)
-            except Exception:
-                stale.append(connection)
-
-        for connection in stale:
-            try:
-                await connection.close()
-            except:
-                pass
-            self.disconnect_from_server(connection, server_id)
+        await self.broker.publish(f"server:{server_id}", encode(message))
+
+    def record_fanout(self, room_key: str, seconds: float):
+        delivery_latency.observe(seconds, room_key.partition(":")[0])
+        stats = self.fanout.get(room_key)
+        if stats is None:
+            stats = self.fanout[room_key] = {"deliveries": 0, "total": 0.0, "max": 0.0, "last": 0.0}
+        stats["deliveries"] += 1
+        stats["total"] += seconds
+        stats["last"] = seconds
+        if seconds > stats["max"]:
+            stats["max"] = seconds
+
+    def fanout_stats(self):
+        """Per-room delivery latency (enqueue -> written to the socket) in milliseconds"""
+        return {
+            room_key: {
+                "deliveries": stats["deliveries"],
+                "avg_ms": round(stats["total"] / stats["deliveries"] * 1000, 3),
+                "max_ms": round(stats["max"] * 1000, 3),
+                "last_ms": round(stats["last"] * 1000, 3),
+            }
+            for room_key, stats in self.fanout.items()
+        }
 
     def get_all_the_rooms(self):
         return self.rooms
 
-    def check_new(self, server_id: str, room: str, username: str):
-        key = (server_id, room)
-        return key not in self.online or username not in self.online[key]
-
-
-manager = ConnectionManager() 
 
+manager = ConnectionManager()
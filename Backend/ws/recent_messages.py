@@ -0,0 +1,209 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from Database.sequence import SEQ_SETTLE_MS
+
+# newest messages kept per room, enough for the largest history page
+RECENT_MESSAGES_PER_ROOM = 256
+# cap over all rooms, the least recently used rooms are dropped past it
+RECENT_MESSAGES_TOTAL = 200_000
+
+
+class RoomBuffer:
+    __slots__ = ("messages", "complete", "warming", "started", "loading", "removed")
+
+    def __init__(self, complete: bool, warming: bool = False):
+        self.messages = OrderedDict()  # message id -> message, in seq order
+        # True while the buffer still holds the room's entire history
+        self.complete = complete
+        # collecting broadcasts until a database snapshot is merged, not served yet
+        self.warming = warming
+        self.started = time.monotonic()
+        # snapshots being read, and the ids deleted meanwhile that they must not bring back
+        self.loading = 0
+        self.removed = set()
+
+
+class RecentMessages:
+    """Bounded per-room buffers of the latest messages, indexed by message id.
+
+    Warming a room creates its buffer before the database is read, so frames
+    broadcast while the snapshot is loading are kept, and the snapshot is
+    merged in by id. From then on broadcasts keep it current so the first
+    history page and reconnect catch-up are served from memory. With several
+    workers a message another worker broadcast just before the buffer
+    existed may not be in the table yet, so the buffer is only served once
+    a snapshot read at least `settle_seconds` after its creation is merged.
+    """
+
+    def __init__(self, per_room: int = RECENT_MESSAGES_PER_ROOM, total: int = RECENT_MESSAGES_TOTAL,
+                 settle_seconds: float = SEQ_SETTLE_MS / 1000):
+        self.per_room = per_room
+        self.total_cap = total
+        self.settle_seconds = settle_seconds
+        self.rooms = OrderedDict()  # room_id -> RoomBuffer, least recently used first
+        self.total = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted_rooms = 0
+
+    def _touch(self, room_id: str):
+        buffer = self.rooms.get(room_id)
+        if buffer is not None:
+            self.rooms.move_to_end(room_id)
+        return buffer
+
+    def _add(self, buffer: RoomBuffer, message: dict):
+        messages = buffer.messages
+        if message["id"] in messages:
+            return
+        # broadcasts can arrive slightly out of seq order, keep the buffer sorted by seq
+        later = []
+        for key, other in reversed(messages.items()):
+            if other["seq"] < message["seq"]:
+                break
+            later.append(key)
+        messages[message["id"]] = message
+        for key in reversed(later):
+            messages.move_to_end(key)
+        self.total += 1
+        if len(messages) > self.per_room:
+            messages.popitem(last=False)
+            buffer.complete = False
+            self.total -= 1
+
+    def _enforce_cap(self):
+        while self.total > self.total_cap and self.rooms:
+            _, buffer = self.rooms.popitem(last=False)
+            self.total -= len(buffer.messages)
+            self.evicted_rooms += 1
+
+    def start_warming(self, room_id: str) -> RoomBuffer:
+        """The room's buffer, created (warming) if it has none. Call before reading the snapshot."""
+        with self.lock:
+            buffer = self._touch(room_id)
+            if buffer is None:
+                buffer = self.rooms[room_id] = RoomBuffer(complete=False, warming=True)
+            buffer.loading += 1
+            return buffer
+
+    def seed(self, room_id: str, buffer: RoomBuffer, messages: list, complete: bool, read_at: float) -> list:
+        """Merge a snapshot of a room's latest messages (oldest first), read at monotonic
+        time `read_at`, into the buffer from start_warming. Returns the room's messages newest first."""
+        with self.lock:
+            snapshot = [message for message in messages[-self.per_room:] if message["id"] not in buffer.removed]
+            buffer.loading -= 1
+            if not buffer.loading:
+                buffer.removed.clear()
+            if self.rooms.get(room_id) is not buffer:
+                # evicted, or the room was deleted, while the snapshot loaded
+                merged = {message["id"]: message for message in snapshot + list(buffer.messages.values())}
+                return sorted(merged.values(), key=lambda message: message["seq"], reverse=True)
+            if buffer.warming:
+                # everything observed is newer than the snapshot, a full snapshot makes the buffer complete
+                buffer.complete = complete and len(messages) <= self.per_room
+                if read_at - buffer.started >= self.settle_seconds:
+                    buffer.warming = False
+            for message in snapshot:
+                self._add(buffer, message)
+            self._enforce_cap()
+            return list(reversed(buffer.messages.values()))
+
+    def cancel_warming(self, buffer: RoomBuffer):
+        """The snapshot read for start_warming failed"""
+        with self.lock:
+            buffer.loading -= 1
+            if not buffer.loading:
+                buffer.removed.clear()
+
+    def append(self, room_id: str, message: dict):
+        with self.lock:
+            buffer = self._touch(room_id)
+            if buffer is not None:
+                self._add(buffer, message)
+                self._enforce_cap()
+
+    def remove(self, room_id: str, message_id: str):
+        with self.lock:
+            buffer = self.rooms.get(room_id)
+            if buffer is None:
+                return
+            if buffer.loading:
+                buffer.removed.add(message_id)
+            if buffer.messages.pop(message_id, None) is not None:
+                self.total -= 1
+
+    def drop(self, room_id: str):
+        with self.lock:
+            buffer = self.rooms.pop(room_id, None)
+            if buffer is not None:
+                self.total -= len(buffer.messages)
+
+    def latest(self, room_id: str, limit: int) -> list | None:
+        """Newest-first page of up to `limit` messages, None when memory cannot answer it"""
+        with self.lock:
+            buffer = self._touch(room_id)
+            if buffer is None or buffer.warming or (len(buffer.messages) < limit and not buffer.complete):
+                self.misses += 1
+                return None
+            self.hits += 1
+            page = []
+            for message in reversed(buffer.messages.values()):
+                page.append(message)
+                if len(page) == limit:
+                    break
+            return page
+
+    def since(self, room_id: str, seq: int) -> list | None:
+        """Messages after a seq, oldest first, None if the buffer does not reach back that far"""
+        with self.lock:
+            buffer = self._touch(room_id)
+            if buffer is None or buffer.warming:
+                self.misses += 1
+                return None
+            missed = []
+            for message in reversed(buffer.messages.values()):
+                if message["seq"] <= seq:
+                    break
+                missed.append(message)
+            else:
+                if not buffer.complete:
+                    # ran off the start of the buffer without finding the position
+                    self.misses += 1
+                    return None
+            self.hits += 1
+            missed.reverse()
+            return missed
+
+    def observe(self, room_id: str, frame: str):
+        """Keep a warm room current from the frames broadcast to it"""
+        if room_id not in self.rooms:
+            return
+        payload = json.loads(frame)
+        if payload.get("action") == "delete_message":
+            self.remove(room_id, payload["message_id"])
+        elif "id" in payload and "content" in payload:
+            self.append(room_id, {
+                "id": payload["id"],
+                "room_id": room_id,
+                "sender": payload["sender"],
+                "content": payload["content"],
+                "timestamp": datetime.fromisoformat(payload["created_at"]),
+                "seq": payload["seq"],
+            })
+
+    def stats(self):
+        return {
+            "rooms": len(self.rooms),
+            "messages": self.total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted_rooms": self.evicted_rooms,
+        }
+
+
+recent_messages = RecentMessages()
@@ -0,0 +1,13 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used when it is missing
+    orjson = None
+
+
+def encode(message) -> str:
+    """Encode a websocket payload to a JSON text frame (same output shape as send_json)"""
+    if orjson is not None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
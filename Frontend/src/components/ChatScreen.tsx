@@ -1,27 +1,54 @@
-import { useEffect, useRef } from "react";
+import { useLayoutEffect, useRef } from "react";
 
-type ChatMessage = { sender: string; content: string };
+type ChatMessage = { id?: string; sender: string; content: string };
 
 type ChatScreenProps = {
   username: string | undefined;
   messages: ChatMessage[];
+  hasOlder: boolean;
+  onLoadOlder: () => void;
 };
 
-export default function ChatScreen({ username, messages }: ChatScreenProps) {
+// distance from the top at which the previous page is requested
+const LOAD_OLDER_PX = 80;
+
+export default function ChatScreen({ username, messages, hasOlder, onLoadOlder }: ChatScreenProps) {
   const containerRef = useRef<HTMLDivElement | null>(null);
+  const lastMessage = useRef<ChatMessage>();
+  const fromBottom = useRef(0);
+
+  useLayoutEffect(() => {
+    const el = containerRef.current;
+    if (!el) return;
+    const last = messages[messages.length - 1];
+    if (last && last === lastMessage.current) {
+      // older messages were prepended, keep the same messages in view
+      el.scrollTop = el.scrollHeight - fromBottom.current;
+    } else {
+      el.scrollTop = el.scrollHeight;
+    }
+    lastMessage.current = last;
+    fromBottom.current = el.scrollHeight - el.scrollTop;
+  }, [messages]);
 
-  useEffect(() => {
+  const handleScroll = () => {
     const el = containerRef.current;
     if (!el) return;
-    el.scrollTop = el.scrollHeight;
-  }, [messages.length]);
+    fromBottom.current = el.scrollHeight - el.scrollTop;
+    if (hasOlder && el.scrollTop < LOAD_OLDER_PX) onLoadOlder();
+  };
 
   return (
-    <section className="chat-body" ref={containerRef}>
+    <section className="chat-body" ref={containerRef} onScroll={handleScroll}>
+      {hasOlder && (
+        <button className="load-older" type="button" onClick={onLoadOlder}>
+          Load older messages
+        </button>
+      )}
       {messages.map((m, idx) => {
         const isOwn = username === m.sender;
         return (
-          <div key={idx} className={isOwn ? "message right" : "message left"}>
+          <div key={m.id ?? idx} className={isOwn ? "message right" : "message left"}>
             {!isOwn && <div className="message-sender">{m.sender}</div>}
             <div className="message-bubble">{m.content}</div>
           </div>
@@ -30,5 +57,3 @@ export default function ChatScreen({ username, messages }: ChatScreenProps) {
     </section>
   );
 }
-
-
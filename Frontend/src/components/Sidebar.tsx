@@ -82,6 +82,12 @@ export default function Sidebar({
     serverWsRef.current.onmessage = (event) => {
       try {
         const payload = JSON.parse(event.data);
+
+        // Answer the server heartbeat so the socket is not reaped
+        if (payload.type === "ping") {
+          serverWsRef.current?.send(JSON.stringify({ type: "pong" }));
+          return;
+        }
         
         // Handle room creation event
         if (payload.type === "room_created" && payload.room) {
@@ -101,6 +107,15 @@ export default function Sidebar({
             return prevRooms;
           });
         }
+
+        // Rooms created in bulk arrive as one event
+        if (payload.type === "rooms_created" && Array.isArray(payload.rooms)) {
+          setRooms((prevRooms) => {
+            const known = new Set(prevRooms.map((r) => r.id));
+            const added: Room[] = payload.rooms.filter((r: Room) => !known.has(r.id));
+            return added.length ? [...prevRooms, ...added] : prevRooms;
+          });
+        }
       } catch (error) {
         console.error("Error parsing WebSocket message:", error);
       }
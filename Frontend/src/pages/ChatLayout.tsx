@@ -16,6 +16,10 @@ export default function ChatLayout() {
   // socket state not used; using ws ref instead
   const [isSidebarOpen, setIsSidebarOpen] = useState(false);
   const [chat, setChat] = useState<any[]>([]);
+  // cursor for the page before the oldest loaded message, null once the start is reached
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const loadingOlder = useRef(false);
+  const activeRoom = useRef<string>();
   const [message, setMessage] = useState("");
   // const [allRoom, setAllRoom] = useState([]);
   const [roomID, setRoomID] = useState<string>();
@@ -37,22 +41,29 @@ export default function ChatLayout() {
   }
   let ws = useRef<WebSocket | null>(null);
   console.log("This is the active room", room);
+  // history comes back newest first, one page at a time
+  const fetchPage = async (id: string, before?: string) => {
+    const query = before ? `?before=${encodeURIComponent(before)}` : "";
+    const res = await fetch(`${baseUrl}/messages/${id}${query}`, options("GET", token as string));
+    if (!res.ok) {
+      const text = await res.text();
+      console.error("Server returned error:", res.status, text);
+      return null;
+    }
+    return res.json();
+  };
+
   useEffect(() => {
+    activeRoom.current = roomID;
+    setChat([]);
+    setNextCursor(null);
     if (!roomID || !token) return;
     const get_data = async () => {
       try {
-        const res = await fetch(
-          `${baseUrl}/messages/${roomID?.toString() || ""}`,
-          options("GET", token)
-        );
-        if (!res.ok) {
-          const text = await res.text();
-          console.error("Server returned error:", res.status, text);
-          return;
-        }
-
-        let data = await res.json();
-        setChat(data);
+        const data = await fetchPage(roomID);
+        if (!data || activeRoom.current !== roomID) return;
+        setChat([...data.messages].reverse());
+        setNextCursor(data.next_cursor);
       } catch (error) {
         console.log(error);
       }
@@ -60,6 +71,26 @@ export default function ChatLayout() {
     get_data();
   }, [roomID]);
 
+  // scroll-back: prepend the page before the oldest loaded message
+  const loadOlder = async () => {
+    if (!roomID || !token || !nextCursor || loadingOlder.current) return;
+    loadingOlder.current = true;
+    try {
+      const data = await fetchPage(roomID, nextCursor);
+      if (!data || activeRoom.current !== roomID) return;
+      setChat((prev: any[]) => {
+        const loaded = new Set(prev.map((m) => m.id));
+        const older = [...data.messages].reverse().filter((m: any) => !loaded.has(m.id));
+        return [...older, ...prev];
+      });
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      console.log(error);
+    } finally {
+      loadingOlder.current = false;
+    }
+  };
+
   useEffect(() => {
     if (!roomID || !token) return;
     //receiving message from backend
@@ -82,7 +113,16 @@ export default function ChatLayout() {
     ws.current.onmessage = (event) => {
       try {
         const payload = JSON.parse(event.data);
-        const new_obj = { sender: payload.sender, content: payload.content };
+        // server heartbeat, sockets that stop answering are reaped
+        if (payload.type === "ping") {
+          ws.current?.send(JSON.stringify({ type: "pong" }));
+          return;
+        }
+        if (payload.action === "delete_message") {
+          setChat((prev: any[]) => prev.filter((m) => m.id !== payload.message_id));
+          return;
+        }
+        const new_obj = { id: payload.id, sender: payload.sender, content: payload.content };
         setChat((prev: any[]) => [...prev, new_obj]);
       } catch (e) {
         // Fallback if server sends plain text
@@ -193,7 +233,12 @@ export default function ChatLayout() {
         />
         {roomID ? (
           <>
-            <ChatScreen username={username} messages={chat as any} />
+            <ChatScreen
+              username={username}
+              messages={chat as any}
+              hasOlder={nextCursor !== null}
+              onLoadOlder={loadOlder}
+            />
             <footer className="chat-input">
               <div className="chat-input-wrapper" ref={emojiPickerRef}>
                 <button